@@ -0,0 +1,65 @@
+#compares the old Counter based colour extraction against the numpy bincount version
+#run from the project folder: python benchmarks/bench_color_extraction.py
+import os, sys, time, tracemalloc
+from collections import Counter
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.photo_analysis import PhotoAnalyzer
+
+#https://docs.python.org/3/library/tracemalloc.html
+#https://docs.python.org/3/library/time.html#time.process_time
+
+NUM_COLORS = 6
+RUNS = 50
+
+
+def legacy_counts(img_quantized):
+    #the original hot path, one python tuple per pixel
+    pixels = list(img_quantized.convert('RGB').getdata())
+    return Counter(pixels).most_common(NUM_COLORS), len(pixels)
+
+
+def vectorised_counts(analyzer, img_quantized):
+    #the numpy path used by PhotoAnalyzer
+    return analyzer._count_palette(img_quantized, NUM_COLORS)
+
+
+def measure(fn, *args):
+    #returns cpu seconds per call and peak traced bytes for a single call
+    start = time.process_time()
+    for _ in range(RUNS):
+        fn(*args)
+    cpu = (time.process_time() - start) / RUNS
+
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu, peak
+
+
+def main():
+    analyzer = PhotoAnalyzer()
+    #noise gives every pixel a different colour before quantising, the worst case for the old path
+    img = Image.effect_noise((150, 150), 80).convert('RGB')
+    img = Image.merge('RGB', (img.getchannel('R'), img.getchannel('G').rotate(90), img.getchannel('B').rotate(180)))
+    img_quantized = img.quantize(colors=NUM_COLORS, method=2)
+
+    legacy_cpu, legacy_peak = measure(legacy_counts, img_quantized)
+    new_cpu, new_peak = measure(vectorised_counts, analyzer, img_quantized)
+
+    #both paths have to agree on the colours and counts
+    legacy, total = legacy_counts(img_quantized)
+    new, _ = vectorised_counts(analyzer, img_quantized)
+    assert sorted(legacy) == sorted(new), "results differ"
+
+    print(f"pixels per image:  {total}")
+    print(f"legacy Counter:    {legacy_cpu * 1000:8.3f} ms cpu  {legacy_peak / 1024:8.1f} KiB peak")
+    print(f"numpy bincount:    {new_cpu * 1000:8.3f} ms cpu  {new_peak / 1024:8.1f} KiB peak")
+    print(f"speedup:           {legacy_cpu / new_cpu:8.1f}x cpu  {legacy_peak / max(new_peak, 1):8.1f}x memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+#benchmarks PhotoAnalyzer.analyze_photo on synthetic images and compares against a stored baseline
+#run from the project folder: python benchmarks/bench_photo_analysis.py
+#after an intentional change (or on a new machine) record a fresh baseline with --update-baseline
+#exits with status 1 if any case got slower or hungrier than the baseline allows
+#only jpeg is decoded at reduced size, so only the jpeg cases stay in the low megabytes. png, gif and
+#webp decode the whole image first (12mp webp peaks near 200MB rss, 12mp png-alpha near 75MB), which
+#is why PhotoAnalyzer refuses those formats above MAX_FULL_DECODE_PIXELS
+import argparse, io, json, os, statistics, sys, time, tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.photo_analysis import PhotoAnalyzer
+
+try:
+    import resource#not available on windows, rss is reported as n/a there
+except ImportError:
+    resource = None
+
+#https://docs.python.org/3/library/tracemalloc.html
+#https://docs.python.org/3/library/resource.html#resource.getrusage
+#https://man7.org/linux/man-pages/man5/proc_pid_status.5.html
+#https://pillow.readthedocs.io/en/stable/reference/block_allocator.html
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "photo_analysis.json")
+
+RESOLUTIONS = {
+    "vga": (640, 480),
+    "1080p": (1920, 1080),
+    "12mp": (4032, 3024),#typical phone camera
+}
+
+#name -> (pillow format, mode the synthetic image is saved in)
+FORMATS = {
+    "jpeg": ("JPEG", "RGB"),
+    "png": ("PNG", "RGB"),
+    "webp": ("WEBP", "RGB"),
+    "gif": ("GIF", "P"),
+    "png-alpha": ("PNG", "RGBA"),
+    "webp-alpha": ("WEBP", "RGBA"),
+}
+
+#metrics compared against the baseline, wall time is reported but too noisy to fail on
+CHECKED = ("cpu_ms", "py_peak_kib", "rss_peak_kib", "pil_blocks")
+#differences smaller than this never count as a regression, stops tiny numbers flapping
+ABSOLUTE_SLACK = {"cpu_ms": 2.0, "py_peak_kib": 64.0, "rss_peak_kib": 1024.0, "pil_blocks": 2}
+
+
+def make_image(size, fmt, mode) -> bytes:
+    #smooth gradients with a little seeded noise so it looks photo like and compresses like one
+    width, height = size
+    rng = np.random.default_rng(width * 31 + height)
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    rgb = np.empty((height, width, 3), dtype=np.float32)
+    rgb[..., 0] = 40 + 180 * x
+    rgb[..., 1] = 60 + 150 * y
+    rgb[..., 2] = 200 - 120 * (x * y)
+    rgb += rng.normal(0, 8, size=(height, width, 1)).astype(np.float32)
+    img = Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8), "RGB")
+
+    if mode == "RGBA":#transparent towards the bottom right
+        alpha = np.clip(255 - 200 * (x * y), 0, 255).astype(np.uint8)
+        img.putalpha(Image.fromarray(alpha, "L"))
+    elif mode == "P":
+        img = img.quantize(colors=256)
+
+    out = io.BytesIO()
+    img.save(out, format=fmt, **({"quality": 85} if fmt in ("JPEG", "WEBP") else {}))
+    return out.getvalue()
+
+
+def _max_rss_kib() -> float | None:
+    #linux keeps the parents high water mark in ru_maxrss even after exec, so use the per process one
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return float(line.split()[1])
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if sys.platform == "darwin" else float(peak)#bytes on mac, KiB on linux
+
+
+def run_case(data: bytes, runs: int) -> dict:
+    #runs in a fresh spawned process so the rss high water mark belongs to this case alone
+    analyzer = PhotoAnalyzer()
+    rss_before = _max_rss_kib()
+
+    #prints silenced, the analyzer logs every step
+    walls, cpus = [], []
+    stdout, sys.stdout = sys.stdout, io.StringIO()
+    try:
+        analyzer.analyze_photo(data)#warm up caches, not timed but its memory use is the rss peak
+        for _ in range(runs):
+            wall, cpu = time.perf_counter(), time.process_time()
+            result = analyzer.analyze_photo(data)
+            walls.append(time.perf_counter() - wall)
+            cpus.append(time.process_time() - cpu)
+
+        #one traced call for python heap and pillow image allocations
+        Image.core.reset_stats()
+        tracemalloc.start()
+        analyzer.analyze_photo(data)
+        _, py_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        pil = Image.core.get_stats()
+    finally:
+        sys.stdout = stdout
+
+    rss_after = _max_rss_kib()
+    return {
+        "ok": bool(result.get("success")),
+        "wall_ms": statistics.median(walls) * 1000,
+        "cpu_ms": statistics.median(cpus) * 1000,
+        "py_peak_kib": py_peak / 1024,
+        "rss_peak_kib": None if rss_before is None else rss_after - rss_before,
+        "pil_images": pil["new_count"],
+        "pil_blocks": pil["allocated_blocks"],
+    }
+
+
+def measure_all(runs: int, only=None) -> dict:
+    results = {}
+    spawn = multiprocessing.get_context("spawn")
+    for res_name, size in RESOLUTIONS.items():
+        for fmt_name, (fmt, mode) in FORMATS.items():
+            case = f"{res_name}/{fmt_name}"
+            if only and not any(o in case for o in only):
+                continue
+            data = make_image(size, fmt, mode)
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                result = pool.submit(run_case, data, runs).result()
+            result["input_kib"] = len(data) / 1024
+            results[case] = result
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    #returns a line for every metric that is worse than baseline * (1 + tolerance) plus the slack
+    failures = []
+    for case, result in results.items():
+        if not result["ok"]:
+            failures.append(f"{case}: analysis failed")
+            continue
+        base = baseline.get(case)
+        if base is None:
+            continue#new case, nothing to compare with until the baseline is updated
+        for metric in CHECKED:
+            now, before = result.get(metric), base.get(metric)
+            if now is None or before is None:
+                continue
+            limit = before * (1 + tolerance) + ABSOLUTE_SLACK[metric]
+            if now > limit:
+                failures.append(f"{case}: {metric} {now:.1f} > {limit:.1f} (baseline {before:.1f})")
+    return failures
+
+
+def _fmt(value, width=9):
+    return f"{'n/a':>{width}}" if value is None else f"{value:{width}.1f}"
+
+
+def print_table(results: dict, baseline: dict):
+    print(f"{'case':<18} {'input KiB':>9} {'wall ms':>9} {'cpu ms':>9} {'base cpu':>9} "
+          f"{'py peak':>9} {'rss peak':>9} {'pil imgs':>8} {'pil blks':>8}")
+    for case, r in results.items():
+        base = baseline.get(case, {})
+        print(f"{case:<18} {_fmt(r['input_kib'])} {_fmt(r['wall_ms'])} {_fmt(r['cpu_ms'])} "
+              f"{_fmt(base.get('cpu_ms'))} {_fmt(r['py_peak_kib'])} {_fmt(r['rss_peak_kib'])} "
+              f"{r['pil_images']:>8} {r['pil_blocks']:>8}")
+    print("memory columns are KiB, rss peak is how far the analysis pushed the process high water mark")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PhotoAnalyzer benchmark and regression check")
+    parser.add_argument("--runs", type=int, default=5, help="timed runs per image, the median is reported")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown/growth, 0.25 = 25%%")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="save these results as the new baseline")
+    parser.add_argument("--only", nargs="*", help="only run cases containing one of these, e.g. 12mp png-alpha")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["cases"]
+
+    results = measure_all(args.runs, args.only)
+    print_table(results, baseline)
+
+    if args.update_baseline:
+        merged = dict(baseline)
+        for case, result in results.items():
+            merged[case] = {k: round(v, 2) if isinstance(v, float) else v for k, v in result.items()}
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({"runs": args.runs, "python": sys.version.split()[0], "cases": merged}, f, indent=2, sort_keys=True)
+        print(f"baseline written to {args.baseline}")
+        return
+
+    failures = compare(results, baseline, args.tolerance)
+    if failures:
+        print(f"\nREGRESSION in {len(failures)} metric(s):")
+        for line in failures:
+            print(f"  {line}")
+        sys.exit(1)
+    print("\nno regressions" if baseline else "\nno baseline yet, run with --update-baseline to record one")
+
+
+if __name__ == "__main__":
+    main()
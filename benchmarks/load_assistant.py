@@ -0,0 +1,161 @@
+#load test for the assistant endpoints, reports p50/p95 latency and time to first token
+#start the app against the fake backend so no API quota is spent, for example:
+#  LLM_PROVIDER=fake ASSISTANT_MAX_PER_USER=8 python app.py
+#  python benchmarks/load_assistant.py --login you@example.com:password --users 8 --requests 10
+#every virtual user keeps its own session and conversation, with one account ASSISTANT_MAX_PER_USER
+#has to be at least --users or most requests come back 429 (that is the per user limit working)
+import argparse, json, statistics, sys, threading, time, uuid
+import httpx
+
+#https://en.wikipedia.org/wiki/Percentile#The_nearest-rank_method
+#https://www.python-httpx.org/async/#streaming-responses
+
+QUESTIONS = [
+    "What shutter speed should I use for waves at Garrettstown?",
+    "How do I keep the sky from blowing out at sunset?",
+    "Which aperture gives the most depth of field for landscapes?",
+    "Is it worth using a polariser on a cloudy day?",
+    "How do I focus at night on the stars?",
+]
+
+
+def percentile(values, pct):
+    #nearest rank, good enough for a few hundred samples
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def login(client: httpx.Client, email: str, password: str):
+    response = client.post("/auth/login", data={"email": email, "password": password})
+    if response.url.path.startswith("/auth/login"):#a failed login shows the form again
+        sys.exit(f"login failed for {email} (status {response.status_code})")
+
+
+def ask_json(client, body):
+    #whole answer, ttft is the same as the latency here
+    started = time.perf_counter()
+    response = client.post("/api/assistant/chat", json=body)
+    latency = time.perf_counter() - started
+    data = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+    return response.status_code, latency, None, data.get("conversation_id")
+
+
+def ask_stream(client, body):
+    #time to the first token event and to the end of the stream
+    started = time.perf_counter()
+    first_token = None
+    conversation_id = None
+    with client.stream("POST", "/api/assistant/chat/stream", json=body) as response:
+        if response.status_code != 200:
+            response.read()
+            return response.status_code, time.perf_counter() - started, None, None
+        event = None
+        for line in response.iter_lines():
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                if event == "conversation":
+                    conversation_id = json.loads(line[5:])["id"]
+                elif event == "token" and first_token is None:
+                    first_token = time.perf_counter() - started
+                elif event == "error":
+                    return 502, time.perf_counter() - started, first_token, conversation_id
+    return 200, time.perf_counter() - started, first_token, conversation_id
+
+
+def virtual_user(index, client, args, results, lock):
+    ask = ask_stream if args.endpoint == "stream" else ask_json
+    conversation_id = None
+    run = uuid.uuid4().hex#makes first questions unique so the answer cache doesn't serve them
+    for n in range(args.requests):
+        if n % args.turns == 0:
+            conversation_id = None
+        message = QUESTIONS[(index + n) % len(QUESTIONS)]
+        if conversation_id is None:
+            message = f"[{run[:12]}-{n}] {message}"
+        body = {"message": message, "conversation_id": conversation_id}
+        try:
+            status, latency, first_token, new_id = ask(client, body)
+        except httpx.HTTPError as e:
+            status, latency, first_token, new_id = f"error: {e.__class__.__name__}", None, None, None
+        conversation_id = new_id or conversation_id
+        with lock:
+            results.append({"status": status, "latency": latency, "ttft": first_token})
+        if args.think:
+            time.sleep(args.think)
+
+
+def _ms(value):
+    return "n/a" if value is None else f"{value * 1000:.0f} ms"
+
+
+def report(results, elapsed, args):
+    ok = [r for r in results if r["status"] == 200]
+    latencies = [r["latency"] for r in ok]
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+    statuses = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+
+    print(f"endpoint   {args.endpoint}  ({args.users} users x {args.requests} requests, {elapsed:.1f} s)")
+    print(f"statuses   {', '.join(f'{k}: {v}' for k, v in sorted(statuses.items()))}")
+    print(f"throughput {len(ok) / elapsed:.2f} answers/s")
+    print(f"latency    p50 {_ms(percentile(latencies, 50))}  p95 {_ms(percentile(latencies, 95))}  "
+          f"max {_ms(max(latencies) if latencies else None)}")
+    if args.endpoint == "stream":
+        print(f"ttft       p50 {_ms(percentile(ttfts, 50))}  p95 {_ms(percentile(ttfts, 95))}")
+    else:
+        print("ttft       n/a for the json endpoint, run with --endpoint stream")
+    if latencies:
+        print(f"mean       {_ms(statistics.mean(latencies))}")
+    if statuses.get("429"):
+        print("429s are the admission limits, raise ASSISTANT_MAX_IN_FLIGHT / ASSISTANT_MAX_PER_USER to test past them")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the photography assistant")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--login", action="append", required=True,
+                        help="email:password, repeat to spread the virtual users over several accounts")
+    parser.add_argument("--users", type=int, default=4, help="concurrent virtual users")
+    parser.add_argument("--requests", type=int, default=10, help="requests per user")
+    parser.add_argument("--turns", type=int, default=3, help="messages per conversation before starting a new one")
+    parser.add_argument("--endpoint", choices=("chat", "stream"), default="chat",
+                        help="chat is /api/assistant/chat, stream is /api/assistant/chat/stream (gives ttft)")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds each user waits between requests")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    logins = []
+    for item in args.login:
+        email, _, password = item.partition(":")
+        logins.append((email, password))
+
+    #log everyone in first so the timed part is only assistant requests
+    clients = []
+    for i in range(args.users):
+        client = httpx.Client(base_url=args.url, timeout=args.timeout, follow_redirects=True)
+        login(client, *logins[i % len(logins)])
+        clients.append(client)
+
+    results, lock = [], threading.Lock()
+    threads = [
+        threading.Thread(target=virtual_user, args=(i, client, args, results, lock))
+        for i, client in enumerate(clients)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        client.close()
+    report(results, elapsed, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
 # events.py
 import datetime as dt#imports all flask tools needed
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, jsonify
 from flask_login import login_required, current_user
 from sqlalchemy.exc import IntegrityError#catch database constraint errors
+from services.stop_order import append_position, move_one, optimise, parse_stop_ids, reorder
 
 #https://flask-sqlalchemy.readthedocs.io/en/stable/queries/
 #https://flask-sqlalchemy.readthedocs.io/en/stable/legacy-query/
@@ -32,7 +33,7 @@ def init_events(db, Location):#this function sets up the events feature as a blu
             "EventStop",
             backref="event",
             cascade="all, delete-orphan",
-            order_by="EventStop.position",
+            order_by="[EventStop.position, EventStop.id]",#id breaks ties the same way the detail page does
             lazy="select",
         )
         #https://docs.python.org/3/library/datetime.html
@@ -55,7 +56,8 @@ def init_events(db, Location):#this function sets up the events feature as a blu
         event_id = db.Column(db.Integer, db.ForeignKey("event.id"), nullable=False)#which event its part of
         location_id = db.Column(db.Integer, db.ForeignKey("location.id"), nullable=False)#which location
 
-        position = db.Column(db.Integer, nullable=False)#what order is it in
+        #what order is it in, spaced POSITION_GAP apart so moves only rewrite the moved stop
+        position = db.Column(db.Integer, nullable=False)
         created_at = db.Column(db.DateTime, default=dt.datetime.utcnow, nullable=False)
 
         #connect each stop to location so we can get the data for it
@@ -64,6 +66,8 @@ def init_events(db, Location):#this function sets up the events feature as a blu
         __table_args__ = (
             #prevent the same location being added twice to the same event
             db.UniqueConstraint("event_id", "location_id", name="uq_event_location"),
+            #stops are always read in order, and appending looks up the last one
+            db.Index("ix_event_stop_event_position", "event_id", "position"),
         )
 
     #Helper functions
@@ -72,28 +76,6 @@ def init_events(db, Location):#this function sets up the events feature as a blu
         if event.user_id != current_user.id:
             abort(403)#if event does not belong to them show error
 
-    def _normalize_positions(event_id):#helper function to fix the positions if they get messed up
-        stops = (
-            EventStop.query.filter_by(event_id=event_id)#only stops belonging to this event
-            .order_by(EventStop.position.asc(), EventStop.id.asc())#sort by position first then by id as a tiebreaker
-            .all()
-        )
-        changed = False#track whether we actually need to update anything
-        for idx, s in enumerate(stops, start=1):#loop through the stops starting from position 1
-            if s.position != idx:#if the position number doesn't match where it should be
-                s.position = idx#fix it to the correct number
-                changed = True#flag that a change was made
-        if changed:
-            db.session.commit()
-
-    def _next_position(event_id):#find position for new stop
-        last = (#find the stop with the highest position number
-            EventStop.query.filter_by(event_id=event_id)#only stops in this event
-            .order_by(EventStop.position.desc())#sort by position descending so the highest is first
-            .first()#just get the one with the highest position
-        )
-        return (last.position + 1) if last else 1#if there are stops already go one higher, otherwise start at 1
-
     #Routes
 
     #List all upcoming events (community page — visible to everyone)
@@ -177,11 +159,9 @@ def init_events(db, Location):#this function sets up the events feature as a blu
     def event_detail(event_id):#shows all details of an event
         event = Event.query.get_or_404(event_id)
 
-        _normalize_positions(event.id)#clean up the stop positions in case any got out of order
-
         stops = (#get all the location stops for this event in the correct order
             EventStop.query.filter_by(event_id=event.id)#only stops belonging to this event
-            .order_by(EventStop.position.asc())#sort them by position so they show up in the right order
+            .order_by(EventStop.position.asc(), EventStop.id.asc())#sort by position, id breaks any old ties
             .all()
         )
         locations = Location.query.order_by(Location.name.asc()).all()#get all locations sorted A-Z for the add location dropdown
@@ -300,7 +280,7 @@ def init_events(db, Location):#this function sets up the events feature as a blu
         stop = EventStop(
             event_id=event.id,#which event this stop belongs to
             location_id=loc.id,#which location it is
-            position=_next_position(event.id),#put it at the end of the list using the helper function
+            position=append_position(db, EventStop, EventStop.event_id, event.id),#after the last stop, worked out in the insert
         )
 
         db.session.add(stop)#add the new stop to the database
@@ -324,9 +304,8 @@ def init_events(db, Location):#this function sets up the events feature as a blu
         if stop.event_id != event.id:#make sure this stop actually belongs to this event
             abort(400)
 
-        db.session.delete(stop)#remove the stop from the database
+        db.session.delete(stop)#remove the stop from the database, gaps in the positions don't matter
         db.session.commit()#save the deletion
-        _normalize_positions(event.id)#clean up the position numbers so there's no gaps after removing one
 
         flash("Location removed from event.", "success")
         return redirect(url_for("events.event_detail", event_id=event.id))
@@ -347,19 +326,49 @@ def init_events(db, Location):#this function sets up the events feature as a blu
         if direction not in {"up", "down"}:#the direction has to be either up or down nothing else
             abort(400)
 
-        _normalize_positions(event.id)#make sure positions are clean before we start swapping
+        #give it a position between the two stops it moves between, nothing else is written
+        if not move_one(db, EventStop, EventStop.event_id, stop, direction):#already at the top or bottom
+            return redirect(url_for("events.event_detail", event_id=event.id))
+        db.session.commit()
 
-        if direction == "up":#if they want to move it up in the list
-            neighbor = EventStop.query.filter_by(event_id=event.id, position=stop.position - 1).first()#find the stop directly above
-        else:
-            neighbor = EventStop.query.filter_by(event_id=event.id, position=stop.position + 1).first()#find the stop directly below
+        return redirect(url_for("events.event_detail", event_id=event.id))
 
-        if not neighbor:#if there's nothing above or below it's already at the top or bottom
-            return redirect(url_for("events.event_detail", event_id=event.id))
-        #swap the positions of the two stops,
-        stop.position, neighbor.position = neighbor.position, stop.position
+    # Reorder every stop at once (creator only), body is {"stop_ids": [...]} in the new order
+    @events_bp.route("/events/<int:event_id>/reorder", methods=["POST"])
+    @login_required
+    def event_reorder(event_id):#saves a drag and drop reorder in one go
+        event = Event.query.get_or_404(event_id)#find the event or 404
+        _require_creator(event)
+
+        stop_ids = parse_stop_ids(request.get_json(silent=True))
+        if stop_ids is None:
+            return jsonify({"success": False, "error": "stop_ids must be a list of stop ids"}), 400
+
+        #a single UPDATE, nothing is written unless the list is exactly this event's stops
+        if not reorder(db, EventStop, EventStop.event_id, event.id, stop_ids):
+            return jsonify({"success": False, "error": "stop_ids must list every stop in this event once"}), 400
         db.session.commit()
+        return jsonify({"success": True, "stop_ids": stop_ids})
 
+    #put the stops in the shortest order by straight line distance, the first/last stop can be kept
+    @events_bp.route("/events/<int:event_id>/optimise", methods=["POST"])
+    @login_required
+    def event_optimise_route(event_id):#nearest neighbour + 2-opt, see services/route_optimiser.py
+        event = Event.query.get_or_404(event_id)
+        _require_creator(event)
+
+        if EventStop.query.filter(EventStop.event_id == event.id).count() < 3:#with 2 stops every order is the same length
+            flash("Add at least three stops to optimise the route.", "info")
+            return redirect(url_for("events.event_detail", event_id=event.id))
+
+        keep_start = request.form.get("keep_start") == "on"#checkboxes on the event page
+        keep_end = request.form.get("keep_end") == "on"
+        before, after = optimise(db, EventStop, EventStop.event_id, event.id, keep_start=keep_start, keep_end=keep_end)
+        if after >= before:
+            flash("This event is already in the shortest order we could find.", "info")
+            return redirect(url_for("events.event_detail", event_id=event.id))
+        db.session.commit()#new order is one UPDATE, saved here
+        flash(f"Route optimised: {before:.1f} km down to {after:.1f} km.", "success")
         return redirect(url_for("events.event_detail", event_id=event.id))
 
     #attach model classes to blueprint for debugging
@@ -0,0 +1,154 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+#https://en.wikipedia.org/wiki/Admission_control
+#https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Retry-After
+#https://docs.python.org/3/library/threading.html#condition-objects
+
+#answers being generated at once across the whole process. gunicorn has 4 threads and a waiting
+#request holds one too, so in flight plus queue is kept at 3 to leave one free for normal pages
+ASSISTANT_MAX_IN_FLIGHT = int(os.getenv("ASSISTANT_MAX_IN_FLIGHT", "2"))
+#answers one user can have running or waiting at once
+ASSISTANT_MAX_PER_USER = int(os.getenv("ASSISTANT_MAX_PER_USER", "1"))
+#requests allowed to wait for a free slot, anyone past this is turned away straight away
+ASSISTANT_MAX_QUEUE = int(os.getenv("ASSISTANT_MAX_QUEUE", "1"))
+#seconds a request waits for a slot before giving up
+ASSISTANT_QUEUE_TIMEOUT = float(os.getenv("ASSISTANT_QUEUE_TIMEOUT", "5"))
+#used for the retry estimate until some real calls have been timed
+DEFAULT_CALL_SECONDS = 4.0
+
+
+class AssistantBusy(Exception):
+    #raised instead of waiting, retry_after is whole seconds for the Retry-After header
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    #decides whether an assistant request may call the model now, after a short wait, or not at all
+    #also remembers a cool down after the API answers 429 so nobody calls it until Retry-After has passed
+    def __init__(self, max_in_flight: int = ASSISTANT_MAX_IN_FLIGHT, max_per_user: int = ASSISTANT_MAX_PER_USER,
+                 max_queue: int = ASSISTANT_MAX_QUEUE, queue_timeout: float = ASSISTANT_QUEUE_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._per_user: Dict[int, int] = {}#running plus waiting requests for each user
+        self._waiting = 0
+        self._cool_down_until = 0.0#time.monotonic() before which calls are refused
+        self._avg_seconds = DEFAULT_CALL_SECONDS#moving average of how long a call holds a slot
+        self._stats = {"admitted": 0, "queued": 0, "rejected_busy": 0, "rejected_user": 0,
+                       "rejected_rate_limit": 0, "timed_out": 0, "rate_limited": 0}
+
+    def _estimate(self, ahead: int) -> int:
+        #caller must hold the lock, rough seconds until a slot frees up for someone with `ahead` in front
+        waves = (ahead + 1) / max(self.max_in_flight, 1)
+        return max(1, math.ceil(self._avg_seconds * waves))
+
+    def _cool_down_left(self) -> float:
+        return max(0.0, self._cool_down_until - time.monotonic())
+
+    def _drop_user(self, user_id: Optional[int]):
+        #caller must hold the lock, gives back one of the user's requests
+        if user_id is None:
+            return
+        left = self._per_user.get(user_id, 0) - 1
+        if left > 0:
+            self._per_user[user_id] = left
+        else:
+            self._per_user.pop(user_id, None)
+
+    def acquire(self, user_id: Optional[int]) -> float:
+        #returns the time the slot was taken, pass it to release(). raises AssistantBusy instead of
+        #queueing when waiting would be pointless (rate limited, this user already busy, queue full)
+        with self._cond:
+            cool_down = self._cool_down_left()
+            if cool_down > 0:
+                self._stats["rejected_rate_limit"] += 1
+                raise AssistantBusy(math.ceil(cool_down), "The assistant is handling a lot of requests")
+            if user_id is not None and self._per_user.get(user_id, 0) >= self.max_per_user:
+                self._stats["rejected_user"] += 1
+                raise AssistantBusy(self._estimate(0), "You already have an answer in progress")
+            if self._in_flight >= self.max_in_flight and self._waiting >= self.max_queue:
+                self._stats["rejected_busy"] += 1
+                raise AssistantBusy(self._estimate(self._waiting), "The assistant is busy")
+            #the user is counted from here, so a second request from them can't queue alongside this one
+            if user_id is not None:
+                self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+            if self._in_flight >= self.max_in_flight:
+                self._waiting += 1
+                self._stats["queued"] += 1
+                try:
+                    deadline = time.monotonic() + self.queue_timeout
+                    while self._in_flight >= self.max_in_flight:
+                        left = deadline - time.monotonic()
+                        if left <= 0 or not self._cond.wait(left):
+                            if self._in_flight < self.max_in_flight:
+                                break
+                            self._stats["timed_out"] += 1
+                            self._drop_user(user_id)
+                            raise AssistantBusy(self._estimate(self._waiting - 1), "The assistant is busy")
+                finally:
+                    self._waiting -= 1
+                #a 429 may have arrived while this request was waiting
+                cool_down = self._cool_down_left()
+                if cool_down > 0:
+                    self._cond.notify()#pass the free slot on, this request isn't taking it
+                    self._drop_user(user_id)
+                    self._stats["rejected_rate_limit"] += 1
+                    raise AssistantBusy(math.ceil(cool_down), "The assistant is handling a lot of requests")
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+            return time.monotonic()
+
+    def release(self, user_id: Optional[int], started: float):
+        with self._cond:
+            self._in_flight -= 1
+            self._drop_user(user_id)
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.monotonic() - started)
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self, user_id: Optional[int]):
+        started = self.acquire(user_id)
+        try:
+            yield
+        finally:
+            self.release(user_id, started)
+
+    def rate_limited(self, retry_after: float) -> int:
+        #the API said 429, refuse new calls until Retry-After has passed. returns the wait in whole seconds
+        seconds = max(1, math.ceil(retry_after))
+        with self._cond:
+            self._cool_down_until = max(self._cool_down_until, time.monotonic() + seconds)
+            self._stats["rate_limited"] += 1
+        return seconds
+
+    def cooling_down(self) -> bool:
+        #for background work that should simply skip a turn while the API is rate limiting
+        with self._cond:
+            return self._cool_down_left() > 0
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                in_flight=self._in_flight,
+                waiting=self._waiting,
+                max_in_flight=self.max_in_flight,
+                cool_down_seconds=math.ceil(self._cool_down_left()),
+                avg_call_seconds=round(self._avg_seconds, 2),
+            )
+        return stats
+
+
+#one controller per process, every assistant endpoint goes through it
+admission = AdmissionController()
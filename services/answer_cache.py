@@ -0,0 +1,181 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+#https://en.wikipedia.org/wiki/W-shingling
+#https://en.wikipedia.org/wiki/Jaccard_index
+#https://docs.python.org/3/library/collections.html#ordereddict-examples-and-recipes
+
+#how many answers are kept, least recently used goes first
+ASSISTANT_CACHE_SIZE = int(os.getenv("ASSISTANT_CACHE_SIZE", "500"))
+#seconds an answer stays valid, advice doesn't change often but the prompt might
+ASSISTANT_CACHE_TTL = int(os.getenv("ASSISTANT_CACHE_TTL", str(6 * 3600)))
+#jaccard similarity of shingles needed to reuse an answer for a differently worded question, 0 turns it off
+#kept high because "sunset at kinsale" and "sunrise at kinsale" are only one word apart
+ASSISTANT_CACHE_SIMILARITY = float(os.getenv("ASSISTANT_CACHE_SIMILARITY", "0.9"))
+
+#words that don't change what's being asked, only ignored for the similarity match
+_FILLER = {
+    "a", "an", "the", "please", "hi", "hello", "hey", "thanks", "thank", "you", "can", "could",
+    "would", "i", "me", "my", "tell", "about", "is", "are", "what", "whats", "do", "does", "some",
+}
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_NUMBERS = re.compile(r"\d+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalise_question(question: str) -> str:
+    #lowercase, unicode folded, apostrophes dropped ("what's" -> "whats"), other punctuation to spaces
+    text = unicodedata.normalize("NFKC", question).casefold()
+    text = text.replace("'", "").replace("’", "")
+    text = _PUNCTUATION.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def numbers(normalised: str) -> tuple:
+    #every number in the question in order, "1/250" and "1/25" share nearly every shingle but aren't
+    #the same question, so a near match has to have exactly the same numbers
+    return tuple(_NUMBERS.findall(normalised))
+
+
+def shingles(normalised: str, size: int = 3) -> frozenset:
+    #character trigrams of the meaningful words, robust to typos and word order changes
+    words = [w for w in normalised.split() if w not in _FILLER]
+    text = " ".join(words) or normalised
+    if len(text) < size:
+        return frozenset([text])
+    return frozenset(text[i:i + size] for i in range(len(text) - size + 1))
+
+
+class _Entry:
+    __slots__ = ("question", "answer", "created", "hits", "shingles", "numbers")
+
+    def __init__(self, question: str, answer: str, shingle_set: frozenset, number_tokens: tuple):
+        self.question = question#as first asked, for the admin view
+        self.answer = answer
+        self.created = time.monotonic()
+        self.hits = 0
+        self.shingles = shingle_set
+        self.numbers = number_tokens
+
+
+class AnswerCache:
+    #thread safe ttl + lru cache of assistant answers for single turn questions
+    #exact matches go through the normalised question, near matches through an inverted
+    #index of shingles so only entries sharing a trigram are ever compared
+    def __init__(self, max_entries: int = ASSISTANT_CACHE_SIZE, ttl: int = ASSISTANT_CACHE_TTL,
+                 similarity: float = ASSISTANT_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()#normalised question -> entry, oldest first
+        self._index: Dict[str, set] = {}#shingle -> normalised questions containing it
+        self._stats = {"hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+    def _drop(self, key: str):
+        #caller must hold the lock
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for shingle in entry.shingles:
+            keys = self._index.get(shingle)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[shingle]
+
+    def _fresh(self, key: str, entry: _Entry) -> bool:
+        #caller must hold the lock, drops the entry if it has expired
+        if time.monotonic() - entry.created <= self.ttl:
+            return True
+        self._drop(key)
+        self._stats["expired"] += 1
+        return False
+
+    def _nearest(self, shingle_set: frozenset, number_tokens: tuple) -> Optional[str]:
+        #caller must hold the lock, the most similar stored question at or above the threshold
+        #that mentions exactly the same numbers
+        shared: Dict[str, int] = {}
+        for shingle in shingle_set:
+            for key in self._index.get(shingle, ()):
+                shared[key] = shared.get(key, 0) + 1
+        best, best_score = None, self.similarity
+        for key, overlap in shared.items():
+            if self._entries[key].numbers != number_tokens:
+                continue
+            other = self._entries[key].shingles
+            score = overlap / (len(shingle_set) + len(other) - overlap)
+            if score >= best_score:
+                best, best_score = key, score
+        return best
+
+    def get(self, question: str) -> Optional[str]:
+        key = normalise_question(question)
+        if not key:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._fresh(key, entry):
+                self._stats["hits"] += 1
+            else:
+                entry = None
+                if self.similarity > 0:
+                    near = self._nearest(shingles(key), numbers(key))
+                    if near is not None and self._fresh(near, self._entries[near]):
+                        key, entry = near, self._entries[near]
+                        self._stats["similar_hits"] += 1
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            entry.hits += 1
+            self._entries.move_to_end(key)#most recently used
+            return entry.answer
+
+    def put(self, question: str, answer: str):
+        key = normalise_question(question)
+        if not key or not answer:
+            return
+        with self._lock:
+            self._drop(key)
+            entry = _Entry(question.strip(), answer, shingles(key), numbers(key))
+            self._entries[key] = entry
+            for shingle in entry.shingles:
+                self._index.setdefault(shingle, set()).add(key)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["similar_hits"] + stats["misses"]
+        stats["lookups"] = lookups
+        stats["hit_rate"] = (stats["hits"] + stats["similar_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def top(self, limit: int = 10) -> List[dict]:
+        #most reused answers, for the admin dashboard
+        with self._lock:
+            now = time.monotonic()
+            entries = [
+                {"question": e.question, "hits": e.hits, "age_minutes": int((now - e.created) // 60)}
+                for e in self._entries.values()
+            ]
+        entries.sort(key=lambda e: e["hits"], reverse=True)
+        return entries[:limit]
+
+
+#one cache per process, shared by the chat endpoints and ask_photography_question
+answer_cache = AnswerCache()
@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+#https://microservices.io/patterns/observability/health-check-api.html
+
+#seconds between probes, 0 turns the background checker off
+ASSISTANT_HEALTH_INTERVAL = int(os.getenv("ASSISTANT_HEALTH_INTERVAL", "60"))
+#a result older than this many intervals is reported as stale (the checker thread has stopped)
+STALE_AFTER_INTERVALS = 3
+
+
+class HealthMonitor:
+    #probes the assistant backend on a background thread and keeps the last result in memory
+    #so the status endpoint is only a dictionary read and never touches the API itself
+    def __init__(self, probe: Callable[[], None], interval: int = ASSISTANT_HEALTH_INTERVAL):
+        self._probe = probe#raises if the backend is unusable
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._available: Optional[bool] = None#None until the first probe has finished
+        self._latency_ms: Optional[int] = None
+        self._error: Optional[str] = None
+        self._checked_at: Optional[float] = None#time.time() of the last probe
+        self._last_ok: Optional[float] = None
+        self._failures = 0#in a row
+
+    def check(self) -> bool:
+        started = time.monotonic()
+        try:
+            self._probe()
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, str(e) or e.__class__.__name__
+        latency = round((time.monotonic() - started) * 1000)
+        with self._lock:
+            self._available = ok
+            self._latency_ms = latency
+            self._error = error
+            self._checked_at = time.time()
+            if ok:
+                self._last_ok = self._checked_at
+                self._failures = 0
+            else:
+                self._failures += 1
+        return ok
+
+    def run_forever(self):
+        #thread target, probes straight away so the status is known soon after startup
+        while True:
+            try:
+                self.check()
+            except Exception as e:#never let the checker thread die
+                print(f"Assistant health check failed: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        threading.Thread(target=self.run_forever, name="assistant-health", daemon=True).start()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            checked_at = self._checked_at
+            state = {
+                "available": self._available,
+                "latency_ms": self._latency_ms,
+                "error": self._error,
+                "consecutive_failures": self._failures,
+                "last_ok": self._last_ok,
+                "checked_at": checked_at,
+            }
+        age = None if checked_at is None else round(time.time() - checked_at)
+        state["age_seconds"] = age
+        state["stale"] = age is not None and self.interval > 0 and age > self.interval * STALE_AFTER_INTERVALS
+        return state
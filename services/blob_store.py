@@ -0,0 +1,129 @@
+import io
+import os
+import uuid
+from typing import Callable, Optional
+import cloudinary
+import cloudinary.api
+import cloudinary.exceptions
+import cloudinary.uploader
+
+#https://en.wikipedia.org/wiki/Content-addressable_storage
+#https://git-scm.com/book/en/v2/Git-Internals-Git-Objects
+
+
+def sharded_key(digest: str, extension: str) -> str:
+    #ab/cd/abcd...ef.jpg, two levels of 256 folders so no single folder ends up with thousands of files
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.{extension.lower()}"
+
+
+class BlobStore:
+    #what every storage backend provides, keys are built from the sha256 of the bytes
+    #so the same photo uploaded twice maps to the same key and is only stored once
+    #reference counting lives in the database (StoredBlob in app.py), a store only moves bytes
+
+    def key_for(self, digest: str, extension: str) -> str:
+        raise NotImplementedError
+
+    def put(self, key: str, data: bytes) -> None:
+        #writing a key that already exists must be safe, the bytes are identical by definition
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        #deleting a key that is already gone is not an error
+        raise NotImplementedError
+
+    def url(self, key: str) -> str:
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        #path on this machine if the backend keeps files on disk, None for remote stores
+        return None
+
+
+class LocalBlobStore(BlobStore):
+    #files under a folder on disk, sharded by the first four hex characters of the hash
+    #keys from before sharding (flat names and thumbs/...) are plain relative paths so they still work
+
+    def __init__(self, root: str, url_builder: Callable[[str], str]):
+        self.root = root
+        self._url_builder = url_builder#turns a key into a url, static files need the flask app for this
+
+    def key_for(self, digest: str, extension: str) -> str:
+        return sharded_key(digest, extension)
+
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self.local_path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        #write to a temp name then rename so a half written file is never visible under the real key
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with open(tmp, "wb") as out:
+                out.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.local_path(key))
+
+    def delete(self, key: str) -> None:
+        path = self.local_path(key)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        #tidy up the shard folders once they are empty, rmdir refuses if anything is left in them
+        folder = os.path.dirname(path)
+        root = os.path.abspath(self.root)
+        while os.path.abspath(folder) != root and os.path.abspath(folder).startswith(root):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break
+            folder = os.path.dirname(folder)
+
+    def url(self, key: str) -> str:
+        return self._url_builder(key)
+
+
+#https://cloudinary.com/documentation/image_upload_api_reference#upload_optional_parameters
+class CloudinaryBlobStore(BlobStore):
+    #the location photo path, the hash becomes the public id inside the folder
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def key_for(self, digest: str, extension: str) -> str:
+        return f"{self.folder}/{digest}"#cloudinary works out the format itself
+
+    def put(self, key: str, data: bytes) -> None:
+        #overwrite off so re-sending bytes we already have doesn't create a new version
+        cloudinary.uploader.upload(
+            io.BytesIO(data),
+            public_id=key,
+            overwrite=False,
+            resource_type="auto",
+        )
+
+    def exists(self, key: str) -> bool:
+        try:
+            cloudinary.api.resource(key)
+            return True
+        except cloudinary.exceptions.NotFound:
+            return False
+
+    def delete(self, key: str) -> None:
+        cloudinary.uploader.destroy(key)
+
+    def url(self, key: str) -> str:
+        return cloudinary.CloudinaryImage(key).build_url(secure=True)
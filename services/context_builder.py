@@ -0,0 +1,196 @@
+import math
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+#https://console.groq.com/docs/model/llama-3.3-70b-versatile
+#https://huggingface.co/docs/transformers/en/pad_truncation
+
+#the whole window a request may use, prompt plus answer, same as num_ctx in the Modelfile
+ASSISTANT_CONTEXT_TOKENS = int(os.getenv("ASSISTANT_CONTEXT_TOKENS", "8192"))
+#most of the window the prompt may take, the rest is left for the answer
+ASSISTANT_PROMPT_BUDGET = int(os.getenv("ASSISTANT_PROMPT_BUDGET", "4096"))
+#longest answer ever asked for, the system prompt asks for short answers anyway
+ASSISTANT_MAX_ANSWER_TOKENS = int(os.getenv("ASSISTANT_MAX_ANSWER_TOKENS", "2048"))
+#never ask for less than this even if the prompt is huge, a cut off answer is still useful
+MIN_ANSWER_TOKENS = 256
+#share of the prompt budget the note about dropped turns may use
+SUMMARY_SHARE = 0.1
+#chat template overhead per message (role header and end of turn tokens)
+MESSAGE_OVERHEAD = 4
+
+
+class TokenEstimator:
+    #no tokenizer for llama 3 is installed so tokens are estimated from characters
+    #(about 4 per token for english). the ratio is corrected from the real prompt_tokens
+    #Groq reports back, so the estimate drifts towards the truth as requests are made
+    CHARS_PER_TOKEN = 4.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._correction = 1.0
+
+    @property
+    def correction(self) -> float:
+        return self._correction
+
+    def count_text(self, text: str) -> int:
+        return math.ceil(len(text) / self.CHARS_PER_TOKEN * self._correction)
+
+    def count_message(self, message: Dict[str, str]) -> int:
+        return self.count_text(message.get("content", "")) + MESSAGE_OVERHEAD
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        return sum(self.count_message(m) for m in messages)
+
+    def observe(self, estimated: int, actual: Optional[int]):
+        #moving average of actual / estimated, clamped so one odd response can't wreck it
+        if not actual or not estimated:
+            return
+        ratio = actual / estimated
+        with self._lock:
+            self._correction = min(2.0, max(0.5, self._correction * (0.8 + 0.2 * ratio)))
+
+
+estimator = TokenEstimator()
+
+
+@dataclass
+class ContextPlan:
+    #what will be sent and how the budget was spent, returned to the client as per request accounting
+    messages: List[Dict[str, str]]
+    prompt_tokens: int#estimated
+    max_tokens: int#answer budget sent to the API
+    history_turns: int = 0#history messages that made it in
+    dropped_turns: int = 0#older messages left out
+    summarised: bool = False#a note about the dropped messages was added
+    few_shot: bool = False
+    conversation_summary: bool = False#the stored rolling summary was included
+    usage: Dict[str, int] = field(default_factory=dict)#filled in from the API response
+
+    def accounting(self) -> dict:
+        return {
+            "estimated_prompt_tokens": self.prompt_tokens,
+            "max_tokens": self.max_tokens,
+            "history_messages": self.history_turns,
+            "dropped_messages": self.dropped_turns,
+            "summarised": self.summarised,
+            "few_shot": self.few_shot,
+            "conversation_summary": self.conversation_summary,
+            **self.usage,
+        }
+
+
+def _truncate(message: Dict[str, str], max_tokens: int) -> Dict[str, str]:
+    #keeps the start and end of an over long message, the middle is usually the least important
+    content = message.get("content", "")
+    keep = int(max(max_tokens - MESSAGE_OVERHEAD, 16) * TokenEstimator.CHARS_PER_TOKEN / estimator.correction)
+    if len(content) <= keep:
+        return message
+    head = keep * 2 // 3
+    tail = keep - head
+    return {**message, "content": content[:head] + "\n[...]\n" + content[-tail:]}
+
+
+def _summary_note(dropped: List[Dict[str, str]], max_tokens: int) -> Optional[Dict[str, str]]:
+    #a short reminder of what the dropped turns were about, built from the users questions
+    #newest first so the most relevant survive if it has to be cut
+    questions = [m["content"].strip().replace("\n", " ") for m in reversed(dropped) if m.get("role") == "user"]
+    if not questions:
+        return None
+    note = "Earlier in this conversation the user asked about: "
+    parts = []
+    for question in questions:
+        part = question if len(question) <= 120 else question[:117] + "..."
+        candidate = {"role": "system", "content": note + "; ".join(parts + [part])}
+        if estimator.count_message(candidate) > max_tokens:
+            break
+        parts.append(part)
+    if not parts:
+        return None
+    return {"role": "system", "content": note + "; ".join(parts)}
+
+
+def build_context(system_prompt: str, few_shot: List[Dict[str, str]], history: List[Dict[str, str]],
+                  summary: Optional[str] = None,
+                  prompt_budget: int = ASSISTANT_PROMPT_BUDGET,
+                  context_tokens: int = ASSISTANT_CONTEXT_TOKENS,
+                  max_answer_tokens: int = ASSISTANT_MAX_ANSWER_TOKENS) -> ContextPlan:
+    #history is the conversation so far ending with the new user message, summary covers anything
+    #before it that has already been folded away on the server
+    #fills the prompt budget newest first: system prompt, new message, recent turns, then a note
+    #about anything older that didn't fit. few shot examples go in on every turn straight after the
+    #system prompt, dropping them later would change the start of the prompt and lose the cached prefix
+    system = {"role": "system", "content": system_prompt}
+    latest, earlier = history[-1], history[:-1]
+
+    used = estimator.count_message(system)
+    #only checked against the system prompt, which is the same every turn, so they're in all turns or none
+    shots: List[Dict[str, str]] = []
+    if few_shot:
+        cost = estimator.count_messages(few_shot)
+        if used + cost <= prompt_budget // 2:
+            shots = few_shot
+            used += cost
+    summary_message = None
+    if summary:#goes straight after the system prompt so the start of the prompt stays the same
+        summary_message = {"role": "system", "content": "Summary of the conversation so far: " + summary}
+        summary_message = _truncate(summary_message, prompt_budget // 4)
+        used += estimator.count_message(summary_message)
+    #the new question always goes in, cut down only if it alone would blow the budget
+    latest = _truncate(latest, max(prompt_budget - used, MIN_ANSWER_TOKENS))
+    used += estimator.count_message(latest)
+
+    #reserve room for the note before filling with history so it can always be added
+    summary_budget = int(prompt_budget * SUMMARY_SHARE)
+    kept: List[Dict[str, str]] = []
+    index = len(earlier)
+    while index > 0:
+        cost = estimator.count_message(earlier[index - 1])
+        if used + cost > prompt_budget - summary_budget:
+            break
+        kept.insert(0, earlier[index - 1])
+        used += cost
+        index -= 1
+    dropped = earlier[:index]
+
+    #an assistant reply at the start of the kept turns makes no sense without its question
+    while kept and kept[0].get("role") == "assistant":
+        dropped.append(kept.pop(0))
+        used -= estimator.count_message(dropped[-1])
+
+    note = _summary_note(dropped, summary_budget) if dropped else None
+    if note:
+        used += estimator.count_message(note)
+
+    messages = (
+        [system] + shots + ([summary_message] if summary_message else [])
+        + ([note] if note else []) + kept + [latest]
+    )
+    max_tokens = max(MIN_ANSWER_TOKENS, min(max_answer_tokens, context_tokens - used))
+    return ContextPlan(
+        messages=messages,
+        prompt_tokens=used,
+        max_tokens=max_tokens,
+        history_turns=len(kept),
+        dropped_turns=len(dropped),
+        summarised=note is not None,
+        few_shot=bool(shots),
+        conversation_summary=summary_message is not None,
+    )
+
+
+def record_usage(plan: ContextPlan, usage) -> ContextPlan:
+    #copies the real token counts from a groq usage object onto the plan and calibrates the estimator
+    if usage is None:
+        return plan
+    prompt = getattr(usage, "prompt_tokens", None)
+    completion = getattr(usage, "completion_tokens", None)
+    plan.usage = {
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "total_tokens": getattr(usage, "total_tokens", None),
+    }
+    estimator.observe(plan.prompt_tokens, prompt)
+    return plan
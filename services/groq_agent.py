@@ -1,7 +1,9 @@
 # Imports required libraries for API calls
-from groq import Groq
 from typing import List, Dict, Any, Optional
-import os
+import threading
+from services.answer_cache import answer_cache
+from services.context_builder import ContextPlan, build_context, record_usage
+from services.llm_providers import LLMProvider, RateLimited, configured_model, make_provider
 
 #previous sources but still relevant
 #https://realpython.com/ollama-python/
@@ -9,8 +11,8 @@ import os
 #https://github.com/pritom007/ollama_chatbot
 #https://github.com/Holthuizen/WebGUI-Ollama
 
-#Model name
-MODEL_NAME = "llama-3.3-70b-versatile"  
+#Model name of the configured provider (LLM_PROVIDER), for status pages
+MODEL_NAME = configured_model()
 
 #System prompt from Modelfile
 SYSTEM_PROMPT = """You are a photography assistant for a web app.
@@ -72,57 +74,62 @@ What's your budget range and what will you mainly shoot (landscapes, wildlife, s
     }
 ]
 
-#https://github.com/groq/groq-python
-#https://github.com/groq/groq-api-cookbook
+#Instructions for the rolling conversation summary
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and a photography assistant.
+Merge the new messages into the existing summary. Keep what later answers depend on:
+the user's camera and gear, the locations and subjects they mentioned, their goals and skill level,
+and any settings or advice already given. Drop greetings and repetition.
+Write plain sentences, under 150 words, no headings."""
 
-
-class GroqAgent:
-    # Agent class for interacting with Groq API
-    # Handles chat requests, streaming responses
-    def __init__(self, model: str = MODEL_NAME):
-        self.model = model  # Name of the model we're using
-        self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-        # Initialize agent with API key from environment
+class AssistantAgent:
+    # Agent class for the photography assistant
+    # Builds the prompt and hands it to a provider (Groq, a local Ollama or the fake load test backend)
+    # Use get_agent() in the app, constructing one makes a new client and connection pool
+    def __init__(self, provider: LLMProvider):
+        self.provider = provider
+        self.model = provider.model  # Name of the model we're using
         
-    def _prepare_messages(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
-        """Prepend system prompt and few-shot examples to user messages"""
-        full_messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-        full_messages.extend(FEW_SHOT_EXAMPLES)
-        full_messages.extend(messages)
-        return full_messages
+    def build_context(self, messages: List[Dict[str, str]], summary: Optional[str] = None) -> ContextPlan:
+        """Fit system prompt, few-shot examples, conversation summary and history into the token budget"""
+        return build_context(SYSTEM_PROMPT, FEW_SHOT_EXAMPLES, messages, summary=summary)
         
-    #Send a chat request to Groq and get a response
+    #Send a chat request and get a response
     #messages has list of messages with role and content keys
     #stream is whether response should be streamed   
-    #Returns dictionary containing success (if it worked), message (the response) and error (Error message)
-    def chat(self, messages: List[Dict[str, str]], stream: bool = False) -> Dict[str, Any]:
+    #Returns dictionary containing success (if it worked), message (the response), usage (token accounting) and error (Error message)
+    #a 429 also sets rate_limited and retry_after (seconds)
+    #summary is the stored rolling summary of turns no longer in messages
+    def chat(self, messages: List[Dict[str, str]], stream: bool = False, summary: Optional[str] = None) -> Dict[str, Any]:
         try:
-            #Prepare messages with system prompt and examples
-            full_messages = self._prepare_messages(messages)
+            if stream:  #Handle streaming vs complete response
+                #Return the token stream, the caller iterates and closes it
+                response, plan = self.open_stream(messages, summary)
+                return {"success": True, "response": response, "usage": plan.accounting()}
             
-            #Make API call to Groq with parameters from modelfile
-            response = self.client.chat.completions.create(
-                model=self.model,  #What model to use
-                messages=full_messages,  #Conversation history with system prompt
-                stream=stream,  #Whether to stream response
-                temperature=0.3,  # From modelfile - more factual / less rambly
-                top_p=0.9,  # From modelfile
-                max_tokens=8192  # Similar to num_ctx from modelfile
-            )
+            #Trim history to the budget and size the answer to what's left of the window
+            plan = self.build_context(messages, summary)
             
-            if stream:  #Handle streaming vs complete response
-                #Return the response object for streaming
-                return {"success": True, "response": response}
-            else:
-                #Parse complete response
-                assistant_message = response.choices[0].message.content
-                #Return structured success response
-                return {
-                    "success": True,
-                    "message": assistant_message,
-                    "model": self.model,
-                    "done": True
-                }
+            #temperature and top_p from the Modelfile, max_tokens is whatever is left of the context window
+            assistant_message, usage = self.provider.complete(
+                plan.messages, max_tokens=plan.max_tokens, temperature=0.3, top_p=0.9
+            )
+            record_usage(plan, usage)
+            #Return structured success response
+            return {
+                "success": True,
+                "message": assistant_message,
+                "model": self.model,
+                "usage": plan.accounting(),
+                "done": True
+            }
+        #Rate limited, tell the caller how long to back off for
+        except RateLimited as e:
+            return {
+                "success": False,
+                "error": f"API request failed: {str(e)}",
+                "rate_limited": True,
+                "retry_after": e.retry_after
+            }
         #Handles API errors        
         except Exception as e:
             return {
@@ -130,44 +137,65 @@ class GroqAgent:
                 "error": f"API request failed: {str(e)}"
             }
     
-    #Stream responses from Groq in real time chunks
+    #Start a streaming completion and hand back the provider's token stream with its context plan
+    #Iterating the stream gives text chunks, stream.usage is filled in once it ends
+    #Errors are raised rather than returned so the caller can report them its own way, a 429 raises RateLimited
+    #The caller must close() the stream when it stops reading, that drops the HTTP
+    #connection and the backend stops generating tokens nobody will see
+    def open_stream(self, messages: List[Dict[str, str]], summary: Optional[str] = None):
+        #Trim history to the budget and size the answer to what's left of the window
+        plan = self.build_context(messages, summary)
+        stream = self.provider.stream(plan.messages, max_tokens=plan.max_tokens, temperature=0.3, top_p=0.9)
+        return stream, plan
+    
+    #Stream responses in real time chunks
     #Args: messages are lists of conversation messages
-    #Yields: string chunks of the response as they are generated by Groq
+    #Yields: string chunks of the response as they are generated
     def chat_stream(self, messages: List[Dict[str, str]]):
         try:
-            #Prepare messages with system prompt and examples
-            full_messages = self._prepare_messages(messages)
-            
-            #Make API call with streaming enabled
-            response = self.client.chat.completions.create(
-                model=self.model,  #Model being used
-                messages=full_messages,  #Conversation history with system prompt
-                stream=True,  #Enables streaming mode
-                temperature=0.3,  #From modelfile
-                top_p=0.9,  #From modelfile
-                max_tokens=8192  #Similar to num_ctx
-            )
-            
-            #Iterate over response chunks as they come
-            for chunk in response:
-                if chunk.choices[0].delta.content:  #Skip empty chunks
-                    content = chunk.choices[0].delta.content
+            response, _ = self.open_stream(messages)
+            try:
+                #Iterate over response chunks as they come
+                for content in response:
                     yield content  #Generator pattern sends chunk back
+            finally:
+                response.close()  #Also runs if the consumer stops reading early
                     
         #If any error occurs during streaming error message                
         except Exception as e:
             yield f"\n\n[Error: {str(e)}]"
     
+    #Fold messages into a running summary with the provider's small model
+    #Returns the new summary or None if the call failed, the old summary is then kept
+    def summarise(self, previous: Optional[str], messages: List[Dict[str, str]], max_tokens: int = 300) -> Optional[str]:
+        transcript = "\n".join(
+            f"{m['role']}: {m['content'][:1500]}" for m in messages  #Long answers are cut, the gist is enough
+        )
+        content = (f"Existing summary:\n{previous}\n\n" if previous else "") + f"New messages:\n{transcript}"
+        try:
+            text, _ = self.provider.complete(
+                [
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": content},
+                ],
+                max_tokens=max_tokens,
+                temperature=0.2,
+                model=self.provider.summary_model,
+            )
+            return text.strip() or None
+        except Exception as e:
+            print(f"Conversation summary failed: {e}")
+            return None
+    
+    def probe(self, timeout: float = 10.0):
+        #Cheap check that the backend is up, spends no tokens. Raises whatever went wrong
+        self.provider.probe(timeout)
+    
     def is_model_available(self) -> bool:
-        #Check to see if API key is working
+        #Check to see if the backend is working
         #Return true if we can connect, if not false
         try:
-            #Make a simple test request
-            test_response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": "test"}],
-                max_tokens=5
-            )
+            self.probe()
             return True
         #If any error occurs assume model is not available    
         except Exception:
@@ -179,24 +207,53 @@ class GroqAgent:
         try:
             return {
                 "name": self.model,
-                "provider": "Groq",
-                "api_configured": bool(os.getenv("GROQ_API_KEY"))
+                "provider": self.provider.name,
             }
         except Exception:  #Return None if any error occurs
             return None
 
 
+#old name, from when Groq was the only backend
+GroqAgent = AssistantAgent
+
+
+_agent = None
+_agent_lock = threading.Lock()
+
+
+def get_agent() -> AssistantAgent:
+    #the process wide agent, created on first use so it's made in the gunicorn worker and not
+    #the --preload master (open sockets don't survive the fork). raises if the provider can't be set up
+    #(for groq that's a missing GROQ_API_KEY)
+    global _agent
+    if _agent is not None:
+        return _agent
+    with _agent_lock:
+        if _agent is None:
+            _agent = AssistantAgent(make_provider())
+    return _agent
+
+
 #Helper function for simple one-off questions
 def ask_photography_question(question: str) -> str:
     # Function for asking single photography question
-    # Creates agent, sends question and returns answer as string
+    # Sends question with the shared agent and returns answer as string
+    # Repeated questions are answered from the shared answer cache
     # Args: question - user's photography question as string
     # Returns: Assistant answer or error message
-    agent = GroqAgent()  # Create new agent
+    cached = answer_cache.get(question)
+    if cached is not None:
+        return cached
+    
+    try:
+        agent = get_agent()  # Shared agent, reuses open connections
+    except Exception as e:
+        return f"Error: {str(e)}"
     messages = [{"role": "user", "content": question}]  # Format question as a message list
     result = agent.chat(messages)  # Send question to model and get response
     
     if result["success"]:  # Check if result was successful
+        answer_cache.put(question, result["message"])  # Only good answers are cached
         return result["message"]  # Return the assistant's message content
     else:  # Return formatted error message
         return f"Error: {result['error']}"
\ No newline at end of file
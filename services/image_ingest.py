@@ -0,0 +1,111 @@
+import io
+from typing import BinaryIO, Tuple
+from PIL import Image, ImageOps
+
+#https://pillow.readthedocs.io/en/stable/reference/Image.html#PIL.Image.Image.draft
+#https://pillow.readthedocs.io/en/stable/reference/Image.html#PIL.Image.Image.thumbnail
+#https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html#jpeg-saving
+
+#default longest edge in pixels, cloudinary only ever serves us 400x300 crops and full views
+DEFAULT_MAX_EDGE = 2048
+#default re-encode quality for jpeg and webp
+DEFAULT_QUALITY = 82
+
+#exif tag number for orientation, the only exif we keep so phones photos stay upright
+ORIENTATION_TAG = 0x0112
+
+#formats we re-encode, gifs are left alone so animations survive
+_REENCODE_FORMATS = {"JPEG", "PNG", "WEBP"}
+
+
+def prepare_upload(stream: BinaryIO, max_edge: int = DEFAULT_MAX_EDGE,
+                   quality: int = DEFAULT_QUALITY) -> Tuple[BinaryIO, dict]:
+    #downscales and strips metadata from an uploaded image before it goes to storage
+    #returns a stream ready to upload and a small dict describing what happened
+    #if the image can't be decoded or is a format we skip the original stream is returned untouched
+    stream.seek(0, io.SEEK_END)
+    original_size = stream.tell()#how many bytes the browser sent us
+    stream.seek(0)
+
+    info = {"original_bytes": original_size, "bytes": original_size, "processed": False}
+
+    try:
+        img = Image.open(stream)
+        fmt = img.format
+        if fmt not in _REENCODE_FORMATS:#gif or anything else goes through as is
+            stream.seek(0)
+            return stream, info
+        if getattr(img, "is_animated", False):#animated webp/apng, saving would only keep the first frame
+            stream.seek(0)
+            return stream, info
+
+        #pull out the orientation before anything else touches the exif
+        orientation = img.getexif().get(ORIENTATION_TAG)
+        icc_profile = img.info.get("icc_profile")#colour profile is small and keeps colours right
+        source_mode = img.mode
+
+        #for jpeg let the decoder skip detail we are about to throw away (1/2, 1/4, 1/8 scale)
+        if fmt == "JPEG":
+            img.draft("RGB", (max_edge, max_edge))
+
+        #thumbnail keeps aspect ratio and only ever shrinks
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS, reducing_gap=3.0)
+
+        if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        save_kwargs = {}
+        #a cmyk profile on rgb pixels makes browsers show the wrong colours, so it only stays
+        #if the pixels are still in the mode it describes
+        if icc_profile and img.mode == source_mode:
+            save_kwargs["icc_profile"] = icc_profile
+        if orientation and orientation != 1:#only write exif if it actually rotates the image
+            exif = Image.Exif()
+            exif[ORIENTATION_TAG] = orientation
+            save_kwargs["exif"] = exif.tobytes()
+
+        if fmt == "JPEG":
+            save_kwargs.update(quality=quality, optimize=True, progressive=True)
+        elif fmt == "WEBP":
+            save_kwargs.update(quality=quality, method=4)
+        else:#png is lossless so just optimise it
+            save_kwargs.update(optimize=True)
+
+        out = io.BytesIO()
+        img.save(out, format=fmt, **save_kwargs)
+
+        #never hand back something bigger than what we were given
+        if out.tell() >= original_size:
+            stream.seek(0)
+            return stream, info
+
+        out.seek(0)
+        info.update(bytes=out.getbuffer().nbytes, processed=True, size=img.size)
+        return out, info
+
+    except Exception as e:#if pillow can't read it let the original through, cloudinary will decide
+        print(f" Ingest skipped: {e}")
+        stream.seek(0)
+        return stream, info
+
+
+#https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html#webp
+#default longest edge and quality for the display thumbnails kept for analyses
+THUMBNAIL_EDGE = 800
+THUMBNAIL_QUALITY = 75
+
+
+def make_thumbnail(source, max_edge: int = THUMBNAIL_EDGE, quality: int = THUMBNAIL_QUALITY) -> bytes:
+    #returns a compact webp copy of an image for display, source is a path, bytes or stream
+    #orientation is applied to the pixels since the thumbnail carries no exif
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        img.draft("RGB", (max_edge, max_edge))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS, reducing_gap=3.0)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+        out = io.BytesIO()
+        img.save(out, format="WEBP", quality=quality, method=4)
+        return out.getvalue()
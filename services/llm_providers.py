@@ -0,0 +1,337 @@
+import hashlib
+import json
+import os
+import random
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+import httpx
+from groq import Groq, RateLimitError
+
+#https://github.com/groq/groq-python
+#https://github.com/ollama/ollama/blob/main/docs/api.md#generate-a-chat-completion
+#https://www.python-httpx.org/advanced/resource-limits/
+
+#which backend answers the assistant: groq, ollama or fake (canned tokens, for load tests)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq").lower()
+
+#Groq models
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+#Small fast model for folding old turns into a conversation summary, nobody reads these directly
+GROQ_SUMMARY_MODEL = os.getenv("GROQ_SUMMARY_MODEL", "llama-3.1-8b-instant")
+
+#local ollama server, same base model as the Modelfile (the system prompt is sent with each request)
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434").rstrip("/")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen2.5:3b")
+OLLAMA_SUMMARY_MODEL = os.getenv("OLLAMA_SUMMARY_MODEL", OLLAMA_MODEL)
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))#num_ctx in the Modelfile
+
+#fake backend speed, tuned to look roughly like a hosted model
+FAKE_LLM_FIRST_TOKEN_MS = int(os.getenv("FAKE_LLM_FIRST_TOKEN_MS", "300"))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "80"))
+FAKE_LLM_ANSWER_TOKENS = int(os.getenv("FAKE_LLM_ANSWER_TOKENS", "120"))
+
+#connection pool settings for the shared client, every chat turn reuses these connections
+#so the TLS handshake to the API only happens when a connection is first opened
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "10"))#most requests in flight at once
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "5"))#idle connections kept open
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "90"))#seconds an idle connection is kept
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))#seconds, per read so long streams are fine
+#the SDK sleeps out 429s and retries inside the request, that ties up a worker thread. the
+#admission controller in app.py turns 429s into a quick "busy" answer instead, so retries default off
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "0"))
+#wait used when a 429 comes without a usable Retry-After header
+DEFAULT_RETRY_AFTER = 5.0
+
+
+class RateLimited(Exception):
+    #raised by any provider when the backend answers 429, retry_after is in seconds
+    def __init__(self, retry_after: float, message: str = "Rate limited by the API"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(headers) -> float:
+    #seconds to wait after a 429, from Retry-After (seconds or an HTTP date) or the default
+    value = headers.get("retry-after") if headers is not None else None
+    if value:
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            pass
+    return DEFAULT_RETRY_AFTER
+
+
+def pooled_http_client() -> httpx.Client:
+    #one httpx client is thread safe and holds the connection pool for the whole process
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+    )
+
+
+@dataclass
+class Usage:
+    #token counts in the same shape as the OpenAI style usage objects Groq returns
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    total_tokens: Optional[int] = None
+
+
+class TokenStream:
+    #what every provider's stream() returns: iterate it for text chunks, usage is set once it ends
+    #close() must be safe to call more than once and stops generation upstream
+    usage: Optional[Usage] = None
+
+    def __iter__(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class LLMProvider:
+    #a chat model backend. messages are already fitted to the budget by context_builder
+    name = "base"
+    model = ""
+    summary_model = ""
+
+    def complete(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float = 0.3,
+                 top_p: float = 0.9, model: Optional[str] = None) -> Tuple[str, Optional[Usage]]:
+        #whole answer and its usage, raises RateLimited on 429 and anything else on failure
+        raise NotImplementedError
+
+    def stream(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float = 0.3,
+               top_p: float = 0.9) -> TokenStream:
+        #raises before returning if the request is refused, so callers can still send a status code
+        raise NotImplementedError
+
+    def probe(self, timeout: float = 10.0) -> None:
+        #cheap check that the backend and model are usable, must not spend tokens. raises if not
+        raise NotImplementedError
+
+
+class _GroqStream(TokenStream):
+    def __init__(self, stream):
+        self._stream = stream
+        self.usage = None
+
+    def __iter__(self):
+        for chunk in self._stream:
+            #Groq puts the token counts on the last chunk of a stream under x_groq
+            usage = getattr(chunk, "usage", None)
+            if usage is None and getattr(chunk, "x_groq", None) is not None:
+                usage = chunk.x_groq.usage
+            if usage is not None:
+                self.usage = Usage(usage.prompt_tokens, usage.completion_tokens, usage.total_tokens)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def close(self):
+        self._stream.close()
+
+
+class GroqProvider(LLMProvider):
+    name = "groq"
+
+    def __init__(self, model: str = GROQ_MODEL, summary_model: str = GROQ_SUMMARY_MODEL,
+                 http_client: Optional[httpx.Client] = None):
+        self.model = model
+        self.summary_model = summary_model
+        self.client = Groq(api_key=os.getenv("GROQ_API_KEY"), http_client=http_client, max_retries=GROQ_MAX_RETRIES)
+
+    def _create(self, **kwargs):
+        try:
+            return self.client.chat.completions.create(**kwargs)
+        except RateLimitError as e:
+            raise RateLimited(retry_after_seconds(e.response.headers), str(e)) from e
+
+    def complete(self, messages, max_tokens, temperature=0.3, top_p=0.9, model=None):
+        response = self._create(model=model or self.model, messages=messages, temperature=temperature,
+                                top_p=top_p, max_tokens=max_tokens)
+        usage = response.usage
+        return (
+            response.choices[0].message.content or "",
+            Usage(usage.prompt_tokens, usage.completion_tokens, usage.total_tokens) if usage else None,
+        )
+
+    def stream(self, messages, max_tokens, temperature=0.3, top_p=0.9):
+        return _GroqStream(self._create(model=self.model, messages=messages, stream=True, temperature=temperature,
+                                        top_p=top_p, max_tokens=max_tokens))
+
+    #https://console.groq.com/docs/api-reference#models-retrieve
+    def probe(self, timeout=10.0):
+        #looks the model up instead of running a completion, checks the key and the model for free
+        self.client.with_options(timeout=timeout, max_retries=0).models.retrieve(self.model)
+
+
+class _OllamaStream(TokenStream):
+    #ollama streams one json object per line, the last one has done=true and the token counts
+    def __init__(self, response: httpx.Response):
+        self._response = response
+        self.usage = None
+
+    def __iter__(self):
+        for line in self._response.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("error"):
+                raise RuntimeError(data["error"])
+            content = data.get("message", {}).get("content")
+            if content:
+                yield content
+            if data.get("done"):
+                self.usage = _ollama_usage(data)
+                break
+
+    def close(self):
+        self._response.close()
+
+
+def _ollama_usage(data: dict) -> Usage:
+    prompt, completion = data.get("prompt_eval_count"), data.get("eval_count")
+    total = prompt + completion if prompt is not None and completion is not None else None
+    return Usage(prompt, completion, total)
+
+
+class OllamaProvider(LLMProvider):
+    #a local ollama (or anything speaking its /api/chat), no key needed
+    name = "ollama"
+
+    def __init__(self, base_url: str = OLLAMA_URL, model: str = OLLAMA_MODEL, summary_model: str = OLLAMA_SUMMARY_MODEL,
+                 http_client: Optional[httpx.Client] = None):
+        self.base_url = base_url
+        self.model = model
+        self.summary_model = summary_model
+        self.http = http_client or pooled_http_client()
+
+    def _body(self, messages, max_tokens, temperature, top_p, model, stream):
+        return {
+            "model": model,
+            "messages": messages,
+            "stream": stream,
+            #same parameters as the Modelfile
+            "options": {"temperature": temperature, "top_p": top_p, "num_predict": max_tokens, "num_ctx": OLLAMA_NUM_CTX},
+        }
+
+    @staticmethod
+    def _check(response: httpx.Response):
+        if response.status_code == 429:
+            response.close()
+            raise RateLimited(retry_after_seconds(response.headers))
+        if response.status_code >= 400:
+            response.read()
+            raise RuntimeError(f"Ollama returned {response.status_code}: {response.text[:200]}")
+
+    def complete(self, messages, max_tokens, temperature=0.3, top_p=0.9, model=None):
+        response = self.http.post(f"{self.base_url}/api/chat",
+                                  json=self._body(messages, max_tokens, temperature, top_p, model or self.model, False))
+        self._check(response)
+        data = response.json()
+        return data.get("message", {}).get("content", ""), _ollama_usage(data)
+
+    def stream(self, messages, max_tokens, temperature=0.3, top_p=0.9):
+        request = self.http.build_request("POST", f"{self.base_url}/api/chat",
+                                          json=self._body(messages, max_tokens, temperature, top_p, self.model, True))
+        response = self.http.send(request, stream=True)
+        self._check(response)
+        return _OllamaStream(response)
+
+    def probe(self, timeout=10.0):
+        #model details only, nothing is generated. fails if the model hasn't been pulled
+        response = self.http.post(f"{self.base_url}/api/show", json={"model": self.model}, timeout=timeout)
+        self._check(response)
+
+
+#words the fake answers are made of
+_FAKE_WORDS = (
+    "aperture shutter ISO light exposure tripod focus composition golden hour contrast "
+    "shadows highlights lens wide telephoto stabilisation noise sharpness bracket histogram"
+).split()
+
+
+class _FakeStream(TokenStream):
+    def __init__(self, tokens: List[str], prompt_tokens: int, first_token_ms: int, tokens_per_second: float):
+        self._tokens = tokens
+        self._prompt_tokens = prompt_tokens
+        self._first_token = first_token_ms / 1000
+        self._gap = 1 / tokens_per_second if tokens_per_second > 0 else 0
+        self._closed = False
+        self.usage = None
+
+    def __iter__(self):
+        time.sleep(self._first_token)
+        sent = 0
+        for index, token in enumerate(self._tokens):
+            if self._closed:
+                break
+            if index:
+                time.sleep(self._gap)
+            sent += 1
+            yield token
+        self.usage = Usage(self._prompt_tokens, sent, self._prompt_tokens + sent)
+
+    def close(self):
+        self._closed = True
+
+
+class FakeProvider(LLMProvider):
+    #canned answers streamed at a fixed speed, the same question always gets the same answer
+    #costs nothing and needs no network, for load testing the app rather than the model
+    name = "fake"
+
+    def __init__(self, first_token_ms: int = FAKE_LLM_FIRST_TOKEN_MS, tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND,
+                 answer_tokens: int = FAKE_LLM_ANSWER_TOKENS):
+        self.model = "fake-photography-model"
+        self.summary_model = self.model
+        self.first_token_ms = first_token_ms
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+
+    def _answer(self, messages, max_tokens) -> Tuple[List[str], int]:
+        question = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        seed = int.from_bytes(hashlib.sha256(question.encode("utf-8")).digest()[:8], "big")
+        rng = random.Random(seed)
+        words = [rng.choice(_FAKE_WORDS) for _ in range(min(self.answer_tokens, max_tokens))]
+        tokens = [w if i == 0 else " " + w for i, w in enumerate(words)]
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        return tokens, prompt_tokens
+
+    def complete(self, messages, max_tokens, temperature=0.3, top_p=0.9, model=None):
+        tokens, prompt_tokens = self._answer(messages, max_tokens)
+        stream = _FakeStream(tokens, prompt_tokens, self.first_token_ms, self.tokens_per_second)
+        text = "".join(stream)#same timing as streaming it
+        return text, stream.usage
+
+    def stream(self, messages, max_tokens, temperature=0.3, top_p=0.9):
+        tokens, prompt_tokens = self._answer(messages, max_tokens)
+        return _FakeStream(tokens, prompt_tokens, self.first_token_ms, self.tokens_per_second)
+
+    def probe(self, timeout=10.0):
+        return None
+
+
+def configured_model() -> str:
+    #model name for status pages, without creating the provider (which may need a key)
+    return {"ollama": OLLAMA_MODEL, "fake": "fake-photography-model"}.get(LLM_PROVIDER, GROQ_MODEL)
+
+
+def make_provider(name: str = LLM_PROVIDER) -> LLMProvider:
+    #the backend picked by LLM_PROVIDER, each gets its own pooled http client
+    if name == "groq":
+        return GroqProvider(http_client=pooled_http_client())
+    if name == "ollama":
+        return OllamaProvider()
+    if name == "fake":
+        return FakeProvider()
+    raise ValueError(f"Unknown LLM_PROVIDER {name!r}, expected groq, ollama or fake")
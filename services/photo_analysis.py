@@ -1,19 +1,52 @@
+import io
 import os
 from PIL import Image
-from typing import Dict, List
-from collections import Counter
+import numpy as np
+from typing import BinaryIO, Dict, List, Union
+from services.similarity import dhash, hash_to_hex
 
 #https://pillow.readthedocs.io/en/stable/reference/Image.html#PIL.Image.Image.quantize
 #https://realpython.com/image-processing-with-the-python-pillow-library/
 #https://stackoverflow.com/questions/3241929/how-to-find-the-dominant-most-common-color-in-an-image
+#https://numpy.org/doc/stable/reference/generated/numpy.bincount.html
+#https://pillow.readthedocs.io/en/stable/reference/Image.html#PIL.Image.Image.draft
+#https://pillow.readthedocs.io/en/stable/reference/Image.html#PIL.Image.Image.resize
+
+#size the analysis works at, colours don't need more detail than this
+ANALYSIS_SIZE = (150, 150)
+#refuse anything bigger than this many pixels (about 50MP) so a tiny file can't expand into gigabytes
+MAX_ANALYSIS_PIXELS = 50_000_000
+#only jpeg can be decoded at reduced size, png/webp/gif are always decoded at full size first so they
+#get a tighter limit. 24MP covers phone photos and keeps the worst case around 100MB (a 12MP webp
+#peaks near 200MB rss in the benchmark, webp is decoded through a python bytes buffer)
+MAX_FULL_DECODE_PIXELS = 24_000_000
+
+#number of buckets in the stored luminance histogram, must divide 256
+HISTOGRAM_BINS = 32
+#luminance at or above this is a blown highlight, at or below CLIP_LOW is crushed shadow
+CLIP_HIGH = 250
+CLIP_LOW = 5
+
+#lookup table from 8 bit srgb to linear light, saves a pow per pixel
+_srgb = np.arange(256, dtype=np.float64) / 255
+_SRGB_TO_LINEAR = np.where(_srgb <= 0.04045, _srgb / 12.92, ((_srgb + 0.055) / 1.055) ** 2.4)
+#linear srgb (d65) to cie xyz
+_SRGB_TO_XYZ = np.array([
+    [0.4124, 0.3576, 0.1805],
+    [0.2126, 0.7152, 0.0722],
+    [0.0193, 0.1192, 0.9505],
+])
+
 class PhotoAnalyzer:
-    def __init__(self):
-        pass
+    def __init__(self, max_pixels: int = MAX_ANALYSIS_PIXELS, max_full_decode_pixels: int = MAX_FULL_DECODE_PIXELS):
+        self.max_pixels = max_pixels#decompression bomb limit checked before any pixels are decoded
+        self.max_full_decode_pixels = min(max_full_decode_pixels, max_pixels)#same for non jpeg formats
     
-    def analyze_photo(self, image_path: str) -> Dict:
+    def analyze_photo(self, source: Union[str, bytes, memoryview, BinaryIO]) -> Dict:
         #analyzes photo colors
+        #source is a file path, the raw bytes of an upload or an open file like object
         try:
-            print(f"🔍 Starting color analysis for: {image_path}")
+            print(f"🔍 Starting color analysis for: {self._describe(source)}")
             #results dictionary with fields
             results = {
                 'success': True,
@@ -21,12 +54,21 @@ class PhotoAnalyzer:
                 'caption': '',
             }
             
+            #decode once, every metric below works from this small copy
+            img = self._load_small(source)
+            
             #analyze colors
             print(" Analyzing colors...")
-            colors = self._analyze_colors(image_path)
+            colors = self._analyze_colors(img)
             print(f" Found {len(colors)} dominant colors")
             results['colors'] = colors
             
+            #exposure, contrast, sharpness and white balance from the same pixels
+            results['properties'] = self._analyze_exposure(img)
+            
+            #perceptual hash for finding duplicate and similar photos later
+            results['phash'] = hash_to_hex(dhash(img))
+            
             #generate summary
             results['summary'] = self._generate_summary(colors)
             
@@ -40,31 +82,18 @@ class PhotoAnalyzer:
                 'error': f'Analysis failed: {str(e)}'
             }
     
-    def _analyze_colors(self, image_path: str, num_colors: int = 6) -> List[Dict]:
+    def _analyze_colors(self, img: Image.Image, num_colors: int = 6) -> List[Dict]:
         #extract dominant colors from image using pil
-        #opens the image resize it for faster processing, reduces the image to a small pallet of colors
+        #takes the already shrunk image, reduces it to a small pallet of colors
         #count how often each color appears, convert into percentages
         try:
-            #open and resize image
-            img = Image.open(image_path)
-            img = img.convert('RGB')
-            img = img.resize((150, 150))
-            
             #ensures image is in standard rgb mode
             img_quantized = img.quantize(colors=num_colors, method=2)
             
-            #convert back to RGB
-            img_quantized = img_quantized.convert('RGB')
-            
-            #get all pixels
-            pixels = list(img_quantized.getdata())
-            
-            #count occurrences of each color
-            color_counts = Counter(pixels)
-            most_common = color_counts.most_common(num_colors)
+            #count how many pixels use each colour
+            most_common, total_pixels = self._count_palette(img_quantized, num_colors)
             
             #calculate percentages
-            total_pixels = len(pixels)
             colors = []
             #percentafe of the image that this color covers
             for color, count in most_common:
@@ -83,6 +112,119 @@ class PhotoAnalyzer:
         except Exception as e:
             print(f" Color analysis error: {e}")
             return []
+    
+    def _describe(self, source) -> str:
+        #what to print in the log for each kind of source
+        if isinstance(source, str):
+            return source
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return f"<{len(source)} bytes in memory>"
+        return getattr(source, 'name', '<stream>')
+    
+    def _load_small(self, source) -> Image.Image:
+        #returns a small rgb copy of the image, jpegs never hold the full size rgb buffer, other formats
+        #are decoded at full size and are capped at max_full_decode_pixels instead
+        #in memory uploads are wrapped rather than written out, BytesIO shares a bytes buffer without copying
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        with Image.open(source) as img:
+            #only the header has been read so far, check the size before decoding anything
+            width, height = img.size
+            if width * height > self.max_pixels:
+                raise Image.DecompressionBombError(
+                    f"Image is {width}x{height}, larger than the {self.max_pixels} pixel limit"
+                )
+            
+            if img.format == "JPEG":
+                #jpeg can decode straight to 1/2, 1/4 or 1/8 scale, ask for the smallest that is still
+                #at least twice the analysis size so the final resize has something to smooth from
+                img.draft('RGB', (ANALYSIS_SIZE[0] * 2, ANALYSIS_SIZE[1] * 2))
+            elif width * height > self.max_full_decode_pixels:
+                raise Image.DecompressionBombError(
+                    f"{img.format} image is {width}x{height}, larger than the {self.max_full_decode_pixels} "
+                    f"pixel limit for formats that are decoded at full size"
+                )
+            
+            #palette and other modes need rgb before resizing, for jpeg this is already rgb after draft
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            
+            #reducing_gap does a cheap box reduce first and only filters the last step
+            return img.resize(ANALYSIS_SIZE, reducing_gap=2.0)
+    
+    #https://en.wikipedia.org/wiki/Relative_luminance
+    #https://pyimagesearch.com/2015/09/07/blur-detection-with-opencv/
+    #https://en.wikipedia.org/wiki/Color_temperature#Approximation
+    def _analyze_exposure(self, img: Image.Image) -> Dict:
+        #every number here comes from one float buffer of the small rgb image
+        rgb = np.asarray(img, dtype=np.uint8)
+        
+        #relative luminance with rec 709 weights, 0 to 255
+        lum = rgb.astype(np.float32) @ np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+        total = lum.size
+        
+        #256 bin histogram in one pass, everything about clipping and the chart is read off it
+        hist = np.bincount(np.clip(lum, 0, 255).astype(np.uint8).ravel(), minlength=256)
+        
+        #laplacian variance, a blurry photo has few edges so the second derivative barely moves
+        laplacian = (
+            lum[:-2, 1:-1] + lum[2:, 1:-1] + lum[1:-1, :-2] + lum[1:-1, 2:]
+            - 4.0 * lum[1:-1, 1:-1]
+        )
+        
+        return {
+            #32 buckets is plenty for the chart and keeps the json small
+            'histogram': [round(float(v) * 100 / total, 2) for v in hist.reshape(HISTOGRAM_BINS, -1).sum(axis=1)],
+            'highlights_clipped': round(float(hist[CLIP_HIGH:].sum()) * 100 / total, 2),
+            'shadows_clipped': round(float(hist[:CLIP_LOW + 1].sum()) * 100 / total, 2),
+            'brightness': round(float(lum.mean()) / 255 * 100, 1),#0 black to 100 white
+            'contrast': round(float(lum.std()) / 255 * 100, 1),#rms contrast as a percentage
+            'sharpness': round(float(laplacian.var()), 1),
+            'color_temperature': self._estimate_color_temperature(img),
+        }
+    
+    def _estimate_color_temperature(self, img: Image.Image) -> int:
+        #average colour in linear light, then convert to cie xy and use mccamys formula
+        #pillow's per channel histogram dotted with the lookup table is much cheaper than looking up every pixel
+        channel_hist = np.asarray(img.histogram(), dtype=np.float64).reshape(3, 256)
+        linear = channel_hist @ _SRGB_TO_LINEAR / channel_hist[0].sum()
+        x_, y_, z_ = _SRGB_TO_XYZ @ linear
+        if x_ + y_ + z_ <= 0:#pure black has no colour to measure
+            return 0
+        x = x_ / (x_ + y_ + z_)
+        y = y_ / (x_ + y_ + z_)
+        n = (x - 0.3320) / (0.1858 - y)
+        cct = 449 * n ** 3 + 3525 * n ** 2 + 6823.3 * n + 5520.33
+        #the formula only holds for roughly daylight colours, clamp anything wild
+        return int(round(min(max(cct, 1000), 40000), -1))
+    
+    def _count_palette(self, img_quantized: Image.Image, num_colors: int):
+        #counts pixels per colour in a palette mode image, returns ([(rgb tuple, count)], total pixels)
+        #the quantized image is palette mode so each pixel is already a small palette index
+        #view those indices as a numpy array instead of building a python tuple per pixel
+        indices = np.asarray(img_quantized).ravel()
+        
+        #count occurrences of each palette index in one pass
+        counts = np.bincount(indices)
+        palette = np.asarray(img_quantized.getpalette()[:len(counts) * 3], dtype=np.uint8).reshape(-1, 3)
+        
+        #two palette slots can hold the same rgb value so merge them like counting rgb tuples would
+        packed = (palette[:, 0].astype(np.uint32) << 16) | (palette[:, 1].astype(np.uint32) << 8) | palette[:, 2]
+        unique_rgb, inverse = np.unique(packed, return_inverse=True)
+        merged = np.bincount(inverse, weights=counts).astype(np.int64)
+        
+        #most common first, ties fall back to rgb order
+        order = np.argsort(-merged, kind='stable')[:num_colors]
+        
+        most_common = []
+        for i in order:
+            count = int(merged[i])
+            if count == 0:#unused palette slot
+                continue
+            rgb = int(unique_rgb[i])
+            most_common.append((((rgb >> 16) & 0xFF, (rgb >> 8) & 0xFF, rgb & 0xFF), count))
+        return most_common, int(indices.size)
+    
     #checks if colors is empty if no colors are detected return message
     def _generate_summary(self, colors: List[Dict]) -> str:
         if not colors or len(colors) == 0:
@@ -126,4 +268,40 @@ class PhotoAnalyzer:
             else:
                 return "neutral"
         except:
-            return "neutral"
\ No newline at end of file
+            return "neutral"
+
+#https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
+#each worker process keeps its own analyzer, set up once by the pool initializer
+_worker_analyzer = None
+
+def _init_worker(max_pixels: int):
+    global _worker_analyzer
+    _worker_analyzer = PhotoAnalyzer(max_pixels=max_pixels)
+
+def _analyze_in_worker(image_path: str) -> Dict:
+    return _worker_analyzer.analyze_photo(image_path)
+
+#Analyse many photos at once spread across every cpu core
+#Returns one result dict per path in the same order as image_paths
+def analyze_batch(image_paths: List[str], max_workers: int = None,
+                  max_pixels: int = MAX_ANALYSIS_PIXELS) -> List[Dict]:
+    if not image_paths:
+        return []
+    workers = min(max_workers or os.cpu_count() or 1, len(image_paths))
+    
+    #one photo or one core isn't worth starting processes for
+    if workers == 1:
+        analyzer = PhotoAnalyzer(max_pixels=max_pixels)
+        return [analyzer.analyze_photo(path) for path in image_paths]
+    
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    #never fork from the web worker, other threads (executors, sweeper, db and http pools) can be holding
+    #locks at that moment and the child would inherit them locked. forkserver starts workers from a clean
+    #single threaded process, windows only has spawn
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(max_pixels,),
+                             mp_context=multiprocessing.get_context(method)) as pool:
+        #chunks cut down on the back and forth between processes for big folders
+        chunksize = max(1, len(image_paths) // (workers * 4))
+        return list(pool.map(_analyze_in_worker, image_paths, chunksize=chunksize))
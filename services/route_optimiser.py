@@ -0,0 +1,248 @@
+#shortest visiting order for a list of coordinates, used to optimise trip and event stops
+#up to EXACT_MAX_STOPS stops every order is checked (Held-Karp), so small trips get the best route
+#bigger ones start from nearest neighbour, then 2-opt (reverse a stretch) and or-opt (move a few
+#stops somewhere else) keep changing it while that makes the route shorter. that stops at a local
+#best, so the route is then shaken up a few times (double bridge) and improved again, keeping
+#whatever came out shortest. not guaranteed optimal past EXACT_MAX_STOPS, it takes a fraction of a
+#second for trips and event itineraries of a hundred or so stops alike
+#routes are open paths, the first and last stop can each be pinned or left for the solver to pick
+#https://en.wikipedia.org/wiki/Haversine_formula
+#https://en.wikipedia.org/wiki/Held%E2%80%93Karp_algorithm
+#https://en.wikipedia.org/wiki/Nearest_neighbour_algorithm
+#https://en.wikipedia.org/wiki/2-opt
+#https://www.sciencedirect.com/topics/computer-science/or-opt
+#https://en.wikipedia.org/wiki/Lin%E2%80%93Kernighan_heuristic (double bridge kick)
+from typing import List, Optional, Sequence
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+#a reversal has to save more than this many km to count, so float noise can't make it loop forever
+_MIN_GAIN_KM = 1e-9
+#longest run of stops or-opt tries moving in one piece
+OR_OPT_SEGMENT = 3
+#safety cap on improvement rounds, real routes settle in a handful
+MAX_ROUNDS = 100
+#with a free start, how many starting points to try and up to how many stops that's worth it
+MULTI_START = 8
+MULTI_START_MAX_STOPS = 30
+#up to this many stops the exact solver is used, it does 2^n * n^2 work so past a dozen it gets slow
+EXACT_MAX_STOPS = 9
+#how many times the best route is shaken up and improved again. each round costs about as much as
+#the first improve, so it's a budget of stop-rounds split between the stops (50 rounds for a
+#dozen stops, 10 for a hundred). fixed seed so the same stops always give the same route
+PERTURB_BUDGET = 1000
+PERTURB_MAX_ROUNDS = 50
+PERTURB_SEED = 0
+
+
+def distance_matrix(lats: Sequence[float], lons: Sequence[float]) -> np.ndarray:
+    #great circle distance in km between every pair of points, all at once with broadcasting
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def route_length(dist: np.ndarray, order: Sequence[int]) -> float:
+    #total km going through the points in this order, no return leg
+    order = np.asarray(order, dtype=np.intp)
+    return float(dist[order[:-1], order[1:]].sum()) if len(order) > 1 else 0.0
+
+
+def nearest_neighbour(dist: np.ndarray, start: int, end: int = None) -> List[int]:
+    #always go to the closest point not visited yet, `end` is held back until last
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    if end is not None:
+        visited[end] = True
+    order = [start]
+    current = start
+    for _ in range(n - 1 - (end is not None)):
+        candidates = np.where(visited, np.inf, dist[current])
+        current = int(np.argmin(candidates))
+        visited[current] = True
+        order.append(current)
+    if end is not None:
+        order.append(end)
+    return order
+
+
+def _padded(dist: np.ndarray, order: Sequence[int]):
+    #a sentinel point that is 0 km from everything is put on both ends of the route, so a move that
+    #touches the first or last stop is the same sum as one in the middle
+    n = len(order)
+    padded = np.zeros((n + 1, n + 1))
+    padded[:n, :n] = dist
+    return padded, np.array([n, *order, n], dtype=np.intp)#real stops are route[1..n]
+
+
+def _two_opt_pass(padded: np.ndarray, route: np.ndarray, first: int, last: int) -> bool:
+    #reverses route[i..j] wherever that shortens it, True if anything changed
+    improved = False
+    for i in range(first, last):
+        j = np.arange(i + 1, last + 1)
+        a, b = route[i - 1], route[i]
+        c, d = route[j], route[j + 1]
+        #km added by the two new edges minus km saved by the two removed ones, for every j at once
+        delta = padded[a, c] + padded[b, d] - padded[a, b] - padded[c, d]
+        best = int(np.argmin(delta))
+        if delta[best] < -_MIN_GAIN_KM:
+            k = int(j[best])
+            route[i:k + 1] = route[i:k + 1][::-1].copy()
+            improved = True
+    return improved
+
+
+def _or_opt_pass(padded: np.ndarray, route: np.ndarray, first: int, last: int) -> bool:
+    #moves a run of 1 to OR_OPT_SEGMENT stops to another place in the route (either way round)
+    #wherever that shortens it, catches the detours 2-opt can't undo on its own
+    improved = False
+    for length in range(1, OR_OPT_SEGMENT + 1):
+        i = first
+        while i + length - 1 <= last:
+            end = i + length - 1
+            before, head, tail, after = route[i - 1], route[i], route[end], route[end + 1]
+            removed = padded[before, head] + padded[tail, after] - padded[before, after]
+            #every gap (k, k+1) it could go into that isn't next to where it is now
+            k = np.arange(first - 1, last + 1)
+            k = k[(k < i - 1) | (k > end)]
+            if len(k) == 0:
+                break
+            left, right = route[k], route[k + 1]
+            forward = padded[left, head] + padded[tail, right] - padded[left, right]
+            backward = padded[left, tail] + padded[head, right] - padded[left, right]
+            added = np.minimum(forward, backward)
+            best = int(np.argmin(added))
+            if added[best] - removed < -_MIN_GAIN_KM:
+                segment = route[i:end + 1].copy()
+                if backward[best] < forward[best]:
+                    segment = segment[::-1]
+                gap = int(k[best])
+                rest = np.concatenate([route[:i], route[end + 1:]])
+                insert_at = gap + 1 if gap < i else gap + 1 - length
+                route[:] = np.concatenate([rest[:insert_at], segment, rest[insert_at:]])
+                improved = True
+            else:
+                i += 1
+    return improved
+
+
+def exact_order(dist: np.ndarray, fix_start: bool = False, fix_end: bool = False) -> List[int]:
+    #Held-Karp: best[mask, j] is the shortest path through the points in mask ending at j, built up
+    #one point at a time. a pinned start is the only allowed first point, a pinned end is left out
+    #of the masks and added on at the very end
+    n = len(dist)
+    end = n - 1 if fix_end else None
+    points = [i for i in range(n) if i != end]
+    m = len(points)
+    sub = dist[np.ix_(points, points)]
+    full = (1 << m) - 1
+    best = np.full((1 << m, m), np.inf)
+    parent = np.full((1 << m, m), -1, dtype=np.intp)
+    for j in ([0] if fix_start else range(m)):
+        best[1 << j, j] = 0.0
+    bits = 1 << np.arange(m)
+    for mask in range(1, full + 1):
+        row = best[mask]
+        if not np.isfinite(row).any():
+            continue
+        #extending by every point k at once, cheapest way in to each k from any j in mask
+        via = row[:, None] + sub
+        came_from = np.argmin(via, axis=0)
+        cost = via[came_from, np.arange(m)]
+        for k in np.flatnonzero((mask & bits) == 0):
+            nxt = mask | int(bits[k])
+            if cost[k] < best[nxt, k]:
+                best[nxt, k] = cost[k]
+                parent[nxt, k] = came_from[k]
+    final = best[full] + (dist[points, end] if end is not None else 0.0)
+    last = int(np.argmin(final))
+    order = []
+    mask = full
+    while last >= 0:
+        order.append(points[last])
+        last, mask = int(parent[mask, last]), mask & ~(1 << last)
+    order.reverse()
+    if end is not None:
+        order.append(end)
+    return order
+
+
+def _double_bridge(route: np.ndarray, first: int, last: int, rng: np.random.Generator) -> Optional[np.ndarray]:
+    #cuts route[first..last] into four pieces A B C D and puts them back as A C B D. 2-opt and or-opt
+    #can't undo that in one move so the search lands somewhere new, the pinned ends stay put
+    if last - first < 3:
+        return None
+    i, j, k = np.sort(rng.choice(np.arange(first + 1, last + 1), size=3, replace=False))
+    kicked = route.copy()
+    kicked[first:last + 1] = np.concatenate([route[first:i], route[j:k], route[i:j], route[k:last + 1]])
+    return kicked
+
+
+def improve(dist: np.ndarray, order: Sequence[int], fix_start: bool = False, fix_end: bool = False) -> List[int]:
+    #2-opt and or-opt moves until neither finds anything shorter, pinned ends are never moved
+    n = len(order)
+    if n < 3:
+        return list(order)
+    padded, route = _padded(dist, order)
+    first = 2 if fix_start else 1
+    last = n - 1 if fix_end else n
+    for _ in range(MAX_ROUNDS):
+        changed = _two_opt_pass(padded, route, first, last)
+        changed = _or_opt_pass(padded, route, first, last) or changed
+        if not changed:
+            break
+    return [int(x) for x in route[1:-1]]
+
+
+def perturb(dist: np.ndarray, order: Sequence[int], fix_start: bool = False, fix_end: bool = False,
+            rounds: Optional[int] = None) -> List[int]:
+    #iterated local search: kick the best route so far, improve it again and keep it if it's shorter
+    rng = np.random.default_rng(PERTURB_SEED)
+    n = len(order)
+    if rounds is None:
+        rounds = min(PERTURB_MAX_ROUNDS, max(1, PERTURB_BUDGET // n))
+    best = list(order)
+    best_length = route_length(dist, best)
+    first = 1 if fix_start else 0
+    last = n - 2 if fix_end else n - 1
+    for _ in range(rounds):
+        kicked = _double_bridge(np.asarray(best, dtype=np.intp), first, last, rng)
+        if kicked is None:
+            break
+        candidate = improve(dist, kicked, fix_start=fix_start, fix_end=fix_end)
+        length = route_length(dist, candidate)
+        if length < best_length - _MIN_GAIN_KM:
+            best, best_length = candidate, length
+    return best
+
+
+def optimise_order(lats: Sequence[float], lons: Sequence[float],
+                   fix_start: bool = False, fix_end: bool = False) -> List[int]:
+    #indexes into lats/lons in visiting order. fix_start/fix_end keep the current first/last point
+    #(index 0 and index n-1) where they are
+    n = len(lats)
+    if n < 3:
+        return list(range(n))
+    dist = distance_matrix(lats, lons)
+    if n <= EXACT_MAX_STOPS:
+        return exact_order(dist, fix_start=fix_start, fix_end=fix_end)
+    end = n - 1 if fix_end else None
+    if fix_start:
+        starts = [0]
+    else:
+        #a free route usually starts at an outlying point, so try the ones furthest from all the others
+        #in total. the search gets stuck in a worse route every so often and a few starts mostly avoid
+        #that, big itineraries get one start so they stay quick
+        totals = dist.sum(axis=1)
+        if end is not None:
+            totals[end] = -np.inf
+        tries = MULTI_START if n <= MULTI_START_MAX_STOPS else 1
+        starts = [int(i) for i in np.argsort(-totals)[:min(tries, n - (end is not None))]]
+    routes = [improve(dist, nearest_neighbour(dist, start, end), fix_start=fix_start, fix_end=fix_end)
+              for start in starts]
+    return perturb(dist, min(routes, key=lambda order: route_length(dist, order)),
+                   fix_start=fix_start, fix_end=fix_end)
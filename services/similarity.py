@@ -0,0 +1,175 @@
+import threading
+import time
+from typing import Callable, Hashable, Iterable, List, Optional, Tuple
+from PIL import Image
+
+#https://www.hackerfactor.com/blog/index.php?/archives/529-Kind-of-Like-That.html
+#https://www.cs.toronto.edu/~norouzi/research/papers/multi_index_hashing.pdf
+
+#dhash compares each pixel to its right hand neighbour on a 9x8 greyscale thumbnail, giving 64 bits
+HASH_SIZE = 8
+#two photos this many bits apart or fewer are treated as the same shot
+DUPLICATE_DISTANCE = 4
+#default search radius for "similar" photos
+SIMILAR_DISTANCE = 12
+
+
+def dhash(img: Image.Image) -> int:
+    #difference hash of an already opened image, small images are fine since only 9x8 pixels are used
+    small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    pixels = small.tobytes()#row by row, one byte per pixel
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def image_dhash(source) -> Optional[int]:
+    #dhash of a file path or stream, jpegs are decoded at reduced size since we only need 9x8 pixels
+    #returns None if the image can't be read, streams are rewound afterwards
+    try:
+        with Image.open(source) as img:
+            img.draft("L", (64, 64))
+            return dhash(img)
+    except Exception as e:
+        print(f" dHash failed: {e}")
+        return None
+    finally:
+        if hasattr(source, "seek"):
+            source.seek(0)
+
+
+def hash_to_hex(value: Optional[int]) -> Optional[str]:
+    #stored as 16 hex characters since 64 unsigned bits don't fit a signed bigint
+    return None if value is None else f"{value:016x}"
+
+
+def hex_to_hash(value: Optional[str]) -> Optional[int]:
+    return None if not value else int(value, 16)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+#every 16 bit pattern within a given number of flipped bits of zero, by radius
+def _flip_masks(bits: int, radius: int) -> List[int]:
+    from itertools import combinations
+    masks = []
+    for r in range(radius + 1):
+        for positions in combinations(range(bits), r):
+            mask = 0
+            for p in positions:
+                mask |= 1 << p
+            masks.append(mask)
+    return masks
+
+
+class MultiIndexHash:
+    #multi index hashing (norouzi et al.), the 64 bit hash is cut into 4 chunks of 16 bits
+    #and each chunk gets its own lookup table. if two hashes are within r bits of each other
+    #at least one chunk must be within r // 4 bits, so we only probe those nearby buckets
+    #and check the few candidates they hold instead of comparing against everything
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    def __init__(self):
+        self._tables = [dict() for _ in range(self.CHUNKS)]#chunk value -> set of keys
+        self._values = {}#key -> full hash
+        self._masks = {}#cache of flip masks per chunk radius
+
+    def __len__(self):
+        return len(self._values)
+
+    def _chunks(self, value: int):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(value >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    def add(self, value: int, key: Hashable):
+        if key in self._values:
+            self.remove(key)
+        self._values[key] = value
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            table.setdefault(chunk, set()).add(key)
+
+    def remove(self, key: Hashable):
+        value = self._values.pop(key, None)
+        if value is None:
+            return
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            bucket = table.get(chunk)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del table[chunk]
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, Hashable]]:
+        #returns (distance, key) for every entry within max_distance, nearest first
+        chunk_radius = max_distance // self.CHUNKS
+        masks = self._masks.get(chunk_radius)
+        if masks is None:
+            masks = self._masks[chunk_radius] = _flip_masks(self.CHUNK_BITS, chunk_radius)
+
+        candidates = set()
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            if not table:
+                continue
+            for mask in masks:
+                bucket = table.get(chunk ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+
+        found = []
+        for key in candidates:
+            distance = hamming(value, self._values[key])
+            if distance <= max_distance:
+                found.append((distance, key))
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class SimilarityIndex:
+    #process wide index that is built lazily from the database on the first search
+    #new hashes are added and deleted ones removed as they happen, and the whole thing
+    #is rebuilt once it gets old so changes made by other worker processes show up
+    def __init__(self, loader: Callable[[], Iterable[Tuple[int, Hashable]]], max_age: int = 600):
+        self._loader = loader#returns (hash, key) pairs for everything in the database
+        self._max_age = max_age#seconds
+        self._lock = threading.Lock()
+        self._index = None
+        self._built_at = 0.0
+
+    def _ensure_built(self):
+        #caller must hold the lock
+        if self._index is None or time.monotonic() - self._built_at > self._max_age:
+            index = MultiIndexHash()
+            for value, key in self._loader():
+                index.add(value, key)
+            self._index = index
+            self._built_at = time.monotonic()
+
+    def add(self, value: Optional[int], key: Hashable):
+        if value is None:
+            return
+        with self._lock:
+            if self._index is None:#not built yet, the loader will pick it up
+                return
+            self._index.add(value, key)
+
+    def remove(self, key: Hashable):
+        with self._lock:
+            if self._index is not None:
+                self._index.remove(key)
+
+    def invalidate(self):
+        #for bulk deletes, the next search rebuilds from the database
+        with self._lock:
+            self._index = None
+
+    def search(self, value: int, max_distance: int = SIMILAR_DISTANCE,
+               exclude: Optional[Hashable] = None) -> List[Tuple[int, Hashable]]:
+        with self._lock:
+            self._ensure_built()
+            return [(d, k) for d, k in self._index.search(value, max_distance) if k != exclude]
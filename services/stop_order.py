@@ -0,0 +1,125 @@
+#ordering for trip and event stops, shared by trips.py and events.py
+#positions are sparse: stops are POSITION_GAP apart, so inserting or moving a stop only ever writes
+#that one stop (it takes a position between its new neighbours). when two neighbours end up with
+#no whole number between them the parent's stops are renumbered once and the gaps are back
+#deleting needs nothing, gaps in the numbering don't matter, only the order does
+#https://www.figma.com/blog/realtime-editing-of-ordered-sequences/
+#https://en.wikipedia.org/wiki/Order-maintenance_problem
+
+from services.route_optimiser import distance_matrix, optimise_order, route_length
+
+POSITION_GAP = 1024
+
+
+def append_position(db, model, parent_column, parent_id):
+    #"after the current last stop" as a sql expression, it's worked out inside the INSERT itself
+    #so adding a stop doesn't need its own max() query first
+    return (
+        db.select(db.func.coalesce(db.func.max(model.position), 0) + POSITION_GAP)
+        .where(parent_column == parent_id)
+        .scalar_subquery()
+    )
+
+
+def ordered(model, parent_column, parent_id):
+    #id breaks ties, rows from before the gaps can share a position
+    return model.query.filter(parent_column == parent_id).order_by(model.position.asc(), model.id.asc())
+
+
+def rebalance(db, model, parent_column, parent_id):
+    #renumbers every stop POSITION_GAP apart in their current order, only runs when a move finds no room
+    for index, stop in enumerate(ordered(model, parent_column, parent_id).all(), start=1):
+        stop.position = index * POSITION_GAP
+    db.session.flush()
+
+
+def _neighbours(db, model, parent_column, stop, direction: str, limit: int = 2):
+    #the next `limit` stops above (up) or below (down) this one, nearest first
+    parent_id = getattr(stop, parent_column.key)
+    query = model.query.filter(parent_column == parent_id)
+    if direction == "up":
+        return (
+            query.filter(db.or_(
+                model.position < stop.position,
+                db.and_(model.position == stop.position, model.id < stop.id),
+            ))
+            .order_by(model.position.desc(), model.id.desc())
+            .limit(limit)
+            .all()
+        )
+    return (
+        query.filter(db.or_(
+            model.position > stop.position,
+            db.and_(model.position == stop.position, model.id > stop.id),
+        ))
+        .order_by(model.position.asc(), model.id.asc())
+        .limit(limit)
+        .all()
+    )
+
+
+def move_one(db, model, parent_column, stop, direction: str) -> bool:
+    #moves the stop one place up or down by giving it a position between the two stops it now
+    #sits between. returns False if it was already first/last. the caller commits
+    for _ in range(2):#the second pass only happens after a rebalance
+        near = _neighbours(db, model, parent_column, stop, direction)
+        if not near:
+            return False
+        if direction == "up":
+            high = near[0].position
+            low = near[1].position if len(near) > 1 else high - 2 * POSITION_GAP
+        else:
+            low = near[0].position
+            high = near[1].position if len(near) > 1 else low + 2 * POSITION_GAP
+        if high - low >= 2:
+            stop.position = (low + high) // 2
+            return True
+        rebalance(db, model, parent_column, getattr(stop, parent_column.key))
+    return False
+
+
+def parse_stop_ids(payload):
+    #the {"stop_ids": [...]} body of a reorder request as a list of ints, None if it's malformed
+    stop_ids = payload.get("stop_ids") if isinstance(payload, dict) else None
+    if not isinstance(stop_ids, list):
+        return None
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in stop_ids):#true is an int in python
+        return None
+    return stop_ids
+
+
+def reorder(db, model, parent_column, parent_id, stop_ids) -> bool:
+    #puts the parent's stops in the order given by stop_ids in one UPDATE (a CASE on id), used by
+    #drag and drop. stop_ids has to be every stop of the parent exactly once, returns False if it
+    #isn't and nothing is written. the caller commits
+    current = db.session.execute(db.select(model.id).where(parent_column == parent_id)).scalars().all()
+    if len(stop_ids) != len(current) or set(stop_ids) != set(current):
+        return False
+    if not stop_ids:
+        return True
+    new_positions = {stop_id: index * POSITION_GAP for index, stop_id in enumerate(stop_ids, start=1)}
+    db.session.execute(
+        db.update(model)
+        .where(parent_column == parent_id, model.id.in_(stop_ids))
+        .values(position=db.case(new_positions, value=model.id))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.expire_all()#stops already loaded this request would still have their old positions
+    return True
+
+
+def optimise(db, model, parent_column, parent_id, keep_start: bool = False, keep_end: bool = False):
+    #reorders the parent's stops into the shortest route the optimiser finds and saves it with
+    #reorder(). keep_start/keep_end pin the current first/last stop. returns (km before, km after),
+    #the caller commits
+    stops = ordered(model, parent_column, parent_id).all()#location is joined, no extra queries
+    lats = [s.location.lat for s in stops]
+    lons = [s.location.lon for s in stops]
+    order = optimise_order(lats, lons, fix_start=keep_start, fix_end=keep_end)
+    dist = distance_matrix(lats, lons)
+    before, after = route_length(dist, range(len(stops))), route_length(dist, order)
+    if after < before:#only write when it's actually shorter, ties keep the user's order
+        reorder(db, model, parent_column, parent_id, [stops[i].id for i in order])
+    else:
+        after = before
+    return before, after
@@ -0,0 +1,19 @@
+#run from the project folder: python -m pytest tests
+from services.answer_cache import AnswerCache
+
+
+def test_near_match_needs_the_same_numbers():
+    cache = AnswerCache(similarity=0.8)
+    cache.put("What shutter speed for waves at 1/250?", "freeze them")
+    cache.put("Best lens for landscapes under 500 euro", "a kit zoom")
+
+    assert cache.get("what shutter speed for waves at 1/25") is None
+    assert cache.get("best lens for landscapes under 5000 euro") is None
+
+
+def test_near_match_still_found_with_same_numbers():
+    cache = AnswerCache(similarity=0.8)
+    cache.put("What shutter speed for waves at 1/250?", "freeze them")
+
+    assert cache.get("what shutter speeds for waves at 1/250") == "freeze them"
+    assert cache.get("What shutter speed for waves at 1/250?") == "freeze them"#exact key
@@ -1,8 +1,9 @@
 # trips.py
 import datetime as dt#imports all flask tools needed
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, jsonify
 from flask_login import login_required, current_user
 from sqlalchemy.exc import IntegrityError#import this to catch database constraint errors(adding same location twice)
+from services.stop_order import POSITION_GAP, append_position, move_one, optimise, parse_stop_ids, reorder
 
 #https://flask-sqlalchemy.readthedocs.io/en/stable/queries/
 #https://flask-sqlalchemy.readthedocs.io/en/stable/legacy-query/
@@ -25,7 +26,7 @@ def init_trips(db, Location):#this function sets up the trip feature as a bluepr
             "TripStop",#this comes from the tripstop table
             backref="trip",
             cascade="all, delete-orphan",#if we delete trip delete all stops
-            order_by="TripStop.position",#load stops in order
+            order_by="[TripStop.position, TripStop.id]",#load stops in order, id breaks ties like the detail page
             lazy="select",#load stops not neseccary if system is struggling
         )
 
@@ -36,7 +37,8 @@ def init_trips(db, Location):#this function sets up the trip feature as a bluepr
         trip_id = db.Column(db.Integer, db.ForeignKey("trip.id"), nullable=False)#id for which trip its on
         location_id = db.Column(db.Integer, db.ForeignKey("location.id"), nullable=False)#which location is it
 
-        #what number is it in the trips 
+        #where it comes in the trip, stops are spaced POSITION_GAP apart so one can be put
+        #between two others without renumbering the rest, only the order means anything
         position = db.Column(db.Integer, nullable=False)
         #when was it created
         created_at = db.Column(db.DateTime, default=dt.datetime.utcnow, nullable=False)
@@ -47,35 +49,14 @@ def init_trips(db, Location):#this function sets up the trip feature as a bluepr
         __table_args__ = (
             #prevent the same location being added twice to the same trip
             db.UniqueConstraint("trip_id", "location_id", name="uq_trip_location"),
+            #stops are always read in order, and appending looks up the last one
+            db.Index("ix_trip_stop_trip_position", "trip_id", "position"),
         )
 
     def _require_owner(trip: Trip):#ensure current user owns the trip
         if trip.user_id != current_user.id:
             abort(403)#if trip does not belong to them show error
 
-    def _normalize_positions(trip_id: int):#helper function to fix the positions if they get messed up
-        #positions are numbered 1,2,3,4
-        stops = (#get all stops for trip sorted by position
-            TripStop.query.filter_by(trip_id=trip_id)
-            .order_by(TripStop.position.asc(), TripStop.id.asc())
-            .all()
-        )
-        changed = False#flag if changes were made
-        for idx, s in enumerate(stops, start=1):#assign position to stop
-            if s.position != idx:
-                s.position = idx
-                changed = True#if stop doesn't match position change it and fix it
-        if changed:
-            db.session.commit()#commit the change 
-
-    def _next_position(trip_id: int) -> int:#function use to find position for new stop
-        last = (#find stop with highest number
-            TripStop.query.filter_by(trip_id=trip_id)
-            .order_by(TripStop.position.desc())
-            .first()
-        )#last stop return position +1
-        return (last.position + 1) if last else 1
-
     @trips_bp.route("/trips", methods=["GET"])#show all users trips
     @login_required#must be logged in to show trups
     def trips_list():#function with the trip list
@@ -106,11 +87,9 @@ def init_trips(db, Location):#this function sets up the trip feature as a bluepr
         trip = Trip.query.get_or_404(trip_id)#find trip or show error
         _require_owner(trip)#make sure trip belongs to user
 
-        _normalize_positions(trip.id)#clean position nymbers
-
-        stops = (#get all stops in the trip
+        stops = (#get all stops in the trip, id breaks ties from before positions were spaced out
             TripStop.query.filter_by(trip_id=trip.id)
-            .order_by(TripStop.position.asc())
+            .order_by(TripStop.position.asc(), TripStop.id.asc())
             .all()
         )
         #get all the locations available
@@ -144,7 +123,8 @@ def init_trips(db, Location):#this function sets up the trip feature as a bluepr
         stop = TripStop(#create a new stio for a trip
             trip_id=trip.id,
             location_id=loc.id,
-            position=_next_position(trip.id),#figure out the position of this stop
+            #after the last stop, worked out inside the insert so it's one statement
+            position=append_position(db, TripStop, TripStop.trip_id, trip.id),
         )
 
         db.session.add(stop)#adds stop to the database
@@ -167,9 +147,8 @@ def init_trips(db, Location):#this function sets up the trip feature as a bluepr
         if stop.trip_id != trip.id:#make sure stop belongs to trip
             abort(400)
 
-        db.session.delete(stop)#delete stop from database
+        db.session.delete(stop)#delete stop from database, the others keep their positions
         db.session.commit()#commit the change
-        _normalize_positions(trip.id)#fix positioning 
 
         flash("Removed from trip.", "success")#show it worked
         return redirect(url_for("trips.trip_detail", trip_id=trip.id))#return them to the trip
@@ -189,20 +168,50 @@ def init_trips(db, Location):#this function sets up the trip feature as a bluepr
         if direction not in {"up", "down"}:#stop can only be moved up or down
             abort(400)
 
-        _normalize_positions(trip.id)#fix the position numbers
-
-        if direction == "up":#find neighbour to swap move up means one above goes down one and this goes up 1
-            neighbor = TripStop.query.filter_by(trip_id=trip.id, position=stop.position - 1).first()
-        else:#move down means swapping with one below
-            neighbor = TripStop.query.filter_by(trip_id=trip.id, position=stop.position + 1).first()
-
-        if not neighbor:#if theirs no one dont swap
+        #only this stop changes, it gets a position between the two stops it moves between
+        if not move_one(db, TripStop, TripStop.trip_id, stop, direction):#already first or last
             return redirect(url_for("trips.trip_detail", trip_id=trip.id))
-        #this stop goes to neigbours position and neighbours goes to its
-        stop.position, neighbor.position = neighbor.position, stop.position
         db.session.commit()#save the change
         #send back to trip detail page
         return redirect(url_for("trips.trip_detail", trip_id=trip.id))
+
+    #drag and drop on the trip page sends the whole new order here instead of one move per step
+    @trips_bp.route("/trips/<int:trip_id>/reorder", methods=["POST"])
+    @login_required
+    def trip_reorder(trip_id: int):#body is {"stop_ids": [every stop id in the new order]}
+        trip = Trip.query.get_or_404(trip_id)#find the trip
+        _require_owner(trip)
+
+        stop_ids = parse_stop_ids(request.get_json(silent=True))
+        if stop_ids is None:
+            return jsonify({"success": False, "error": "stop_ids must be a list of stop ids"}), 400
+
+        #one UPDATE for all the stops, rejected if the list isn't exactly this trip's stops
+        if not reorder(db, TripStop, TripStop.trip_id, trip.id, stop_ids):
+            return jsonify({"success": False, "error": "stop_ids must list every stop in this trip once"}), 400
+        db.session.commit()
+        return jsonify({"success": True, "stop_ids": stop_ids})
+
+    #put the stops in the shortest order by straight line distance, the first/last stop can be kept
+    @trips_bp.route("/trips/<int:trip_id>/optimise", methods=["POST"])
+    @login_required
+    def trip_optimise_route(trip_id: int):#nearest neighbour + 2-opt, see services/route_optimiser.py
+        trip = Trip.query.get_or_404(trip_id)
+        _require_owner(trip)
+
+        if TripStop.query.filter(TripStop.trip_id == trip.id).count() < 3:#with 2 stops every order is the same length
+            flash("Add at least three stops to optimise the route.", "info")
+            return redirect(url_for("trips.trip_detail", trip_id=trip.id))
+
+        keep_start = request.form.get("keep_start") == "on"#checkboxes on the trip page
+        keep_end = request.form.get("keep_end") == "on"
+        before, after = optimise(db, TripStop, TripStop.trip_id, trip.id, keep_start=keep_start, keep_end=keep_end)
+        if after >= before:
+            flash("This trip is already in the shortest order we could find.", "info")
+            return redirect(url_for("trips.trip_detail", trip_id=trip.id))
+        db.session.commit()#new order is one UPDATE, saved here
+        flash(f"Route optimised: {before:.1f} km down to {after:.1f} km.", "success")
+        return redirect(url_for("trips.trip_detail", trip_id=trip.id))
     #attach model classes to blueprint used when im debugging or with errors
     trips_bp.Trip = Trip
     trips_bp.TripStop = TripStop
@@ -261,7 +270,7 @@ def init_trips(db, Location):#this function sets up the trip feature as a bluepr
             stop = TripStop(
                 trip_id=trip.id, #foregin key which trip this stop belongs to
                 location_id=location.id, # foreign key which locations to visit
-                position=position # sequential order which stop in what order
+                position=position * POSITION_GAP # spaced out order which stop in what order
             )
             db.session.add(stop)
         